@@ -3,28 +3,63 @@
 # On top of tree, fire and burned i added empty space.
 # These empty spaces are used to plant new trees and to simulate the growth of the forest
 
+import argparse
+import csv
+import itertools
+import os
+import struct
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from matplotlib.colors import ListedColormap
 
-def render_anim(size, p, f, density, model_name):
-    forest = init_forest(size, density)
+# record appends every generation to a trajectory file written by TrajectoryWriter
+# replay shows a saved trajectory from start_frame on instead of running the model,
+# frames are read straight from the memory-mapped file
+def render_anim(size, p, f, density, model_name, step=None, buffered=False, record=None, packed=False,
+                replay=None, start_frame=0):
+    trajectory = Trajectory(replay) if replay is not None else None
+    writer = None
+    if trajectory is not None:
+        forest = trajectory[start_frame]
+        frames = range(start_frame, len(trajectory))
+    else:
+        # update_forest_vectorized is used by default, update_forest can be passed as step to compare
+        if step is None:
+            step = update_forest_vectorized
+        forest = init_forest(size, density, dtype=np.uint8 if buffered else int)
+        # Buffered mode steps two preallocated uint8 grids instead of creating a new grid every frame
+        if buffered:
+            buffers = ForestBuffers(forest, p, f)
+            step = lambda *_: buffers.step()
+        frames = None
+        if record is not None:
+            writer = TrajectoryWriter(record, forest.shape, packed=packed)
+            writer.append(forest)
 
     fig, ax = plt.subplots()
     ax.set_title(model_name)
     cmap = ListedColormap(['white', 'green', 'red', 'black'])
     img = ax.imshow(forest, cmap=cmap, vmin=0, vmax=3, interpolation='nearest', origin='lower')
 
-    def update_frame(_):
+    def update_frame(i):
         nonlocal forest
-        forest = update_forest(forest, size, p, f)
+        if trajectory is not None:
+            forest = trajectory[i]
+        else:
+            forest = step(forest, size, p, f)
+            if writer is not None:
+                writer.append(forest)
         img.set_data(forest)
         return [img]
 
     anim = FuncAnimation(
         fig,
         update_frame,
+        frames=frames,
         interval=100,
         blit=True,
         repeat=True,
@@ -32,16 +67,22 @@ def render_anim(size, p, f, density, model_name):
     )
 
     plt.show()
+    if writer is not None:
+        writer.close()
 
 # Function to initialize the forest with trees and fire
 # empty = 0, tree = 1, fire = 2, burned = 3
-def init_forest(size, density):
+# dtype=np.uint8 stores one byte per cell instead of eight, the random draws stay the same
+# rng can be a np.random.Generator, by default the global np.random state is used
+def init_forest(size, density, dtype=int, rng=None):
     empty, tree, fire = 0, 1, 2
+    if rng is None:
+        rng = np.random
     # Initialize the forest with trees and empty spaces
-    forest = np.random.choice([empty, tree], size=(size, size), p=[1 - density, density])
+    forest = rng.choice(np.array([empty, tree], dtype=dtype), size=(size, size), p=[1 - density, density])
 
     # Set a random number of trees on fire
-    fire_start = np.random.choice(size * size, size // 20, replace=False)
+    fire_start = rng.choice(size * size, size // 20, replace=False)
     for idx in fire_start:
         x, y = divmod(idx, size)
         if forest[x, y] == tree:
@@ -78,9 +119,544 @@ def update_forest(forest, size, p, f):
 
     return new_forest
 
+# Function to find cells with at least one burning neighbour (up, down, left, right)
+# The burning mask is shifted in all four directions instead of checking every cell in a loop
+def burning_neighbours(burning):
+    near_fire = np.zeros_like(burning)
+    near_fire[1:, :] |= burning[:-1, :]
+    near_fire[:-1, :] |= burning[1:, :]
+    near_fire[:, 1:] |= burning[:, :-1]
+    near_fire[:, :-1] |= burning[:, 1:]
+    return near_fire
+
+# Array based version of update_forest with the same rules
+# update_forest is kept as the reference implementation
+# Random numbers are drawn in one batch, one number for every cell that update_forest would draw for,
+# in the same row by row order, so both functions give the same forest for the same np.random.seed
+def update_forest_vectorized(forest, size, p, f):
+    empty, tree, fire, burned = 0, 1, 2, 3
+
+    near_fire = burning_neighbours(forest == fire)
+    trees = forest == tree
+    bare = (forest == empty) | (forest == burned)
+
+    # Empty or burned cells draw for regrowth, trees without burning neighbours draw for lightning
+    draws = bare | (trees & ~near_fire)
+    chance = np.random.rand(np.count_nonzero(draws))
+    hit = np.zeros_like(draws)
+    hit[draws] = chance < np.where(bare[draws], p, f)
+
+    new_forest = forest.copy()
+    new_forest[bare] = empty
+    new_forest[bare & hit] = tree
+    new_forest[trees & (near_fire | hit)] = fire
+    new_forest[forest == fire] = burned
+
+    return new_forest
+
+# Double buffered forest stored as uint8 (one byte per cell)
+# Both grids and every scratch mask are allocated once, step writes the next generation
+# into the spare grid and swaps the two, so a long run makes no allocations per step
+# The rules are the same as in update_forest, but every cell gets its own float32 random number
+# from a np.random.Generator, so the results do not follow np.random.seed
+class ForestBuffers:
+    def __init__(self, forest, p, f, seed=None):
+        self.p = p
+        self.f = f
+        self.rng = np.random.default_rng(seed)
+        self.current = np.array(forest, dtype=np.uint8)
+        self.next = np.empty_like(self.current)
+
+        shape = self.current.shape
+        self.chance = np.empty(shape, dtype=np.float32)
+        self.burning = np.empty(shape, dtype=bool)
+        self.near_fire = np.empty(shape, dtype=bool)
+        self.trees = np.empty(shape, dtype=bool)
+        self.bare = np.empty(shape, dtype=bool)
+        self.hit = np.empty(shape, dtype=bool)
+
+    # Number of bytes held by the grids and scratch arrays
+    def nbytes(self):
+        arrays = [self.current, self.next, self.chance, self.burning, self.near_fire, self.trees, self.bare, self.hit]
+        return sum(a.nbytes for a in arrays)
+
+    def step(self):
+        empty, tree, fire, burned = 0, 1, 2, 3
+        cur, nxt = self.current, self.next
+        burning, near_fire, hit = self.burning, self.near_fire, self.hit
+
+        np.equal(cur, fire, out=burning)
+        np.equal(cur, tree, out=self.trees)
+        np.equal(cur, empty, out=self.bare)
+        np.equal(cur, burned, out=hit)
+        np.logical_or(self.bare, hit, out=self.bare)
+
+        # Same shifted masks as burning_neighbours, written into the preallocated mask
+        near_fire.fill(False)
+        np.logical_or(near_fire[1:, :], burning[:-1, :], out=near_fire[1:, :])
+        np.logical_or(near_fire[:-1, :], burning[1:, :], out=near_fire[:-1, :])
+        np.logical_or(near_fire[:, 1:], burning[:, :-1], out=near_fire[:, 1:])
+        np.logical_or(near_fire[:, :-1], burning[:, 1:], out=near_fire[:, :-1])
+
+        self.rng.random(out=self.chance, dtype=np.float32)
+
+        nxt.fill(empty)
+        # Empty or burned cells regrow with probability p
+        np.less(self.chance, self.p, out=hit)
+        np.logical_and(hit, self.bare, out=hit)
+        np.copyto(nxt, tree, where=hit)
+        # Trees stay trees unless a neighbour burns or lightning strikes with probability f
+        np.copyto(nxt, tree, where=self.trees)
+        np.less(self.chance, self.f, out=hit)
+        np.logical_or(hit, near_fire, out=hit)
+        np.logical_and(hit, self.trees, out=hit)
+        np.copyto(nxt, fire, where=hit)
+        # Fire burns out
+        np.copyto(nxt, burned, where=burning)
+
+        self.current, self.next = nxt, cur
+        return self.current
+
+# Sparse forest for runs with few fires
+# It keeps the flat indices of the burning cells (the fire front) and of the cells that burned out last step,
+# spread only looks at the four neighbours of the front
+# Regrowth and lightning pick cells with bulk random draws: every cell is picked independently with probability
+# p or f, which is the same as the dense rules, but only the picked cells are looked at
+# The cost of a step grows with the front and with p * area + f * area, not with the whole area
+class SparseForest:
+    def __init__(self, forest, p, f, seed=None):
+        fire, burned = 2, 3
+        self.p = p
+        self.f = f
+        self.rng = np.random.default_rng(seed)
+        self.forest = np.array(forest, dtype=np.uint8)
+        self.flat = self.forest.reshape(-1)
+        self.front = np.flatnonzero(self.flat == fire)
+        self.burned = np.flatnonzero(self.flat == burned)
+
+    # Picks every cell with the given probability
+    # Gaps between picked cells of such a process are geometric, so the picks are the cumulative sums of the gaps
+    def sample_cells(self, probability):
+        n = self.flat.size
+        if probability <= 0:
+            return np.empty(0, dtype=np.int64)
+        picked = []
+        last = -1
+        while True:
+            gaps = self.rng.geometric(probability, size=int(n * probability * 1.1) + 16)
+            cells = last + np.cumsum(gaps)
+            picked.append(cells[cells < n])
+            if cells[-1] >= n:
+                return np.concatenate(picked)
+            last = cells[-1]
+
+    def step(self):
+        empty, tree, fire, burned = 0, 1, 2, 3
+        flat = self.flat
+        rows, cols = self.forest.shape
+        front = self.front
+
+        # Trees next to the front catch fire
+        r, c = np.divmod(front, cols)
+        neighbours = np.concatenate([front[r > 0] - cols, front[r < rows - 1] + cols,
+                                     front[c > 0] - 1, front[c < cols - 1] + 1])
+        spread = neighbours[flat[neighbours] == tree]
+
+        # Lightning strikes trees, trees next to the front already burn
+        struck = self.sample_cells(self.f)
+        struck = struck[flat[struck] == tree]
+        new_front = np.union1d(spread, struck)
+
+        # Burned cells from the last step and empty cells regrow
+        regrown = self.burned[self.rng.random(self.burned.size) < self.p]
+        sprouts = self.sample_cells(self.p)
+        sprouts = sprouts[flat[sprouts] == empty]
+
+        # All sets were chosen from the old states, so they do not overlap
+        flat[self.burned] = empty
+        flat[regrown] = tree
+        flat[sprouts] = tree
+        flat[front] = burned
+        flat[new_front] = fire
+
+        self.burned = front
+        self.front = new_front
+        return self.forest
+
+# Writes the next generation of rows [start, stop) of cur into the same rows of nxt
+# The row just above and just below the strip are read from cur as one row halos,
+# so a strip only needs its neighbours to have finished the previous generation
+def step_strip(cur, nxt, start, stop, p, f, rng):
+    empty, tree, fire, burned = 0, 1, 2, 3
+    lo = max(start - 1, 0)
+    hi = min(stop + 1, cur.shape[0])
+    near_fire = burning_neighbours(cur[lo:hi] == fire)[start - lo:stop - lo]
+
+    rows = cur[start:stop]
+    chance = rng.random(rows.shape, dtype=np.float32)
+    trees = rows == tree
+    bare = (rows == empty) | (rows == burned)
+
+    out = nxt[start:stop]
+    out.fill(empty)
+    out[bare & (chance < p)] = tree
+    out[trees] = tree
+    out[trees & (near_fire | (chance < f))] = fire
+    out[rows == fire] = burned
+
+# Barrier shared by the strip workers, set by the pool initializer
+_strip_barrier = None
+
+def _init_strip_worker(barrier):
+    global _strip_barrier
+    _strip_barrier = barrier
+
+# Runs one strip for a number of generations inside a pool worker
+# Both grids live in shared memory, after each generation the workers wait on the barrier
+# so every halo row is complete before anyone reads it
+# A worker that fails aborts the barrier, so the others stop waiting and the error reaches run
+def _run_strip(names, shape, generation, start, stop, p, f, steps, rng_state):
+    shms = [shared_memory.SharedMemory(name=name) for name in names]
+    try:
+        grids = [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf) for shm in shms]
+        rng = np.random.default_rng()
+        rng.bit_generator.state = rng_state
+        for t in range(generation, generation + steps):
+            try:
+                step_strip(grids[t % 2], grids[(t + 1) % 2], start, stop, p, f, rng)
+            except BaseException:
+                _strip_barrier.abort()
+                raise
+            _strip_barrier.wait()
+        del grids
+        return rng.bit_generator.state
+    finally:
+        for shm in shms:
+            shm.close()
+
+# Parallel forest split into horizontal strips, one strip per worker process
+# The two uint8 grids are kept in shared memory and swapped every generation
+# Every strip has its own RNG stream spawned from seed, so a run is reproducible for the same seed and number
+# of workers, no matter how the steps are split between run calls
+class ParallelForest:
+    def __init__(self, forest, p, f, workers=None, seed=None):
+        self.p = p
+        self.f = f
+        self.workers = workers or mp.cpu_count()
+        self.shape = forest.shape
+        self.generation = 0
+
+        self.shms = [shared_memory.SharedMemory(create=True, size=forest.size) for _ in range(2)]
+        self.grids = [np.ndarray(self.shape, dtype=np.uint8, buffer=shm.buf) for shm in self.shms]
+        self.grids[0][...] = forest
+
+        bounds = np.linspace(0, self.shape[0], self.workers + 1).astype(int)
+        self.strips = list(zip(bounds[:-1], bounds[1:]))
+        self.rng_states = [np.random.default_rng(child).bit_generator.state
+                           for child in np.random.SeedSequence(seed).spawn(self.workers)]
+
+        # fork shares the barrier with the workers, the grids are attached by name
+        ctx = mp.get_context("fork")
+        barrier = ctx.Barrier(self.workers)
+        self.pool = ctx.Pool(self.workers, initializer=_init_strip_worker, initargs=(barrier,))
+
+    # Current grid, it is a view into shared memory and changes with the next run
+    @property
+    def forest(self):
+        return self.grids[self.generation % 2]
+
+    def run(self, steps):
+        names = [shm.name for shm in self.shms]
+        tasks = [(names, self.shape, self.generation, start, stop, self.p, self.f, steps, state)
+                 for (start, stop), state in zip(self.strips, self.rng_states)]
+        self.rng_states = self.pool.starmap(_run_strip, tasks, chunksize=1)
+        self.generation += steps
+        return self.forest
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        del self.grids
+        for shm in self.shms:
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+# Measures steps/sec of ParallelForest for each number of workers
+def benchmark_parallel(size, steps, p, f, density, workers_list):
+    forest = init_forest(size, density, dtype=np.uint8)
+    results = []
+    for workers in workers_list:
+        with ParallelForest(forest, p, f, workers=workers, seed=0) as parallel:
+            start = time.perf_counter()
+            parallel.run(steps)
+            rate = steps / (time.perf_counter() - start)
+        results.append((workers, rate))
+        print(f"{workers} workers: {rate:.2f} steps/sec, speedup {rate / results[0][1]:.2f}x")
+    return results
+
+# Compares memory use and speed of the stepping modes on one grid
+# update_forest is only measured on small grids because it loops over every cell in Python
+def benchmark_forest(size, steps, p, f, density):
+    forest = init_forest(size, density)
+    results = []
+
+    if size <= 200:
+        grid = forest.copy()
+        start = time.perf_counter()
+        for _ in range(steps):
+            grid = update_forest(grid, size, p, f)
+        # The grid and its copy made every step
+        results.append(("update_forest", 2 * grid.nbytes, steps / (time.perf_counter() - start)))
+
+    grid = forest.copy()
+    start = time.perf_counter()
+    for _ in range(steps):
+        grid = update_forest_vectorized(grid, size, p, f)
+    # The grid, its copy and four boolean masks made every step
+    results.append(("update_forest_vectorized", 2 * grid.nbytes + 4 * grid.size, steps / (time.perf_counter() - start)))
+
+    buffers = ForestBuffers(forest, p, f)
+    start = time.perf_counter()
+    for _ in range(steps):
+        buffers.step()
+    results.append(("ForestBuffers", buffers.nbytes(), steps / (time.perf_counter() - start)))
+
+    for name, nbytes, rate in results:
+        print(f"{name}: {nbytes / 2**20:.1f} MiB, {rate:.2f} steps/sec")
+    return results
+
+# Trajectory files store every generation of a run as uint8 frames after a 32 byte header
+# The header holds the grid shape, whether frames are packed and the number of frames
+# Packed frames store four cells per byte (two bits per state), every frame has the same size,
+# so any frame can be found without reading the ones before it
+TRAJECTORY_MAGIC = b"FFTRAJ01"
+TRAJECTORY_HEADER = struct.Struct("<8sIIB7xQ")
+
+def pack_states(forest):
+    flat = forest.reshape(-1).astype(np.uint8, copy=False)
+    padded = np.zeros(-(-flat.size // 4) * 4, dtype=np.uint8)
+    padded[:flat.size] = flat
+    quads = padded.reshape(-1, 4)
+    return quads[:, 0] | (quads[:, 1] << 2) | (quads[:, 2] << 4) | (quads[:, 3] << 6)
+
+def unpack_states(packed, shape):
+    cells = (packed[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3
+    return cells.reshape(-1)[:shape[0] * shape[1]].reshape(shape)
+
+# Appends generations to a trajectory file through a memory map
+# The file grows in chunks of frames, close writes the frame count and cuts off the unused space
+class TrajectoryWriter:
+    def __init__(self, path, shape, packed=False, chunk_frames=64):
+        self.path = path
+        self.shape = tuple(shape)
+        self.packed = packed
+        self.chunk_frames = chunk_frames
+        cells = self.shape[0] * self.shape[1]
+        self.frame_bytes = -(-cells // 4) if packed else cells
+        self.frames = 0
+        self.capacity = 0
+        self.mm = None
+        with open(path, "wb") as file:
+            file.write(self.header())
+        self.grow(chunk_frames)
+
+    def header(self):
+        return TRAJECTORY_HEADER.pack(TRAJECTORY_MAGIC, self.shape[0], self.shape[1], self.packed, self.frames)
+
+    def grow(self, capacity):
+        if self.mm is not None:
+            self.mm.flush()
+            del self.mm
+        with open(self.path, "r+b") as file:
+            file.truncate(TRAJECTORY_HEADER.size + capacity * self.frame_bytes)
+        self.capacity = capacity
+        self.mm = np.memmap(self.path, dtype=np.uint8, mode="r+", offset=TRAJECTORY_HEADER.size,
+                            shape=(capacity, self.frame_bytes))
+
+    def append(self, forest):
+        if self.frames == self.capacity:
+            self.grow(self.capacity + max(self.capacity, self.chunk_frames))
+        if self.packed:
+            self.mm[self.frames] = pack_states(forest)
+        else:
+            self.mm[self.frames] = forest.reshape(-1)
+        self.frames += 1
+
+    # Writes the frame count, so frames appended so far can be read while the run goes on
+    def flush(self):
+        self.mm.flush()
+        with open(self.path, "r+b") as file:
+            file.write(self.header())
+
+    def close(self):
+        self.flush()
+        del self.mm
+        self.mm = None
+        with open(self.path, "r+b") as file:
+            file.truncate(TRAJECTORY_HEADER.size + self.frames * self.frame_bytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+# Read only view of a trajectory file
+# Unpacked frames are views into the memory map, nothing is copied or recomputed when seeking
+class Trajectory:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            magic, rows, cols, packed, frames = TRAJECTORY_HEADER.unpack(file.read(TRAJECTORY_HEADER.size))
+        if magic != TRAJECTORY_MAGIC:
+            raise ValueError(f"{path} is not a forest fire trajectory")
+        self.shape = (rows, cols)
+        self.packed = bool(packed)
+        frame_bytes = -(-rows * cols // 4) if self.packed else rows * cols
+        self.frames = np.memmap(path, dtype=np.uint8, mode="r", offset=TRAJECTORY_HEADER.size,
+                                shape=(frames, frame_bytes))
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    def __getitem__(self, i):
+        if self.packed:
+            return unpack_states(self.frames[i], self.shape)
+        return self.frames[i].reshape(self.shape)
+
+# Sizes of the clusters of burning cells, cells are connected through their four neighbours
+# Every burning cell starts with its own label, labels of neighbouring cells are set to the smaller one
+# and followed to their own label until nothing changes
+def fire_cluster_sizes(forest):
+    burning = forest == 2
+    cells = np.flatnonzero(burning)
+    if cells.size == 0:
+        return np.empty(0, dtype=np.int64)
+    rows, cols = forest.shape
+
+    r, c = np.divmod(np.flatnonzero(burning[:, :-1] & burning[:, 1:]), cols - 1)
+    right = r * cols + c
+    down = np.flatnonzero(burning[:-1, :] & burning[1:, :])
+    a = np.searchsorted(cells, np.concatenate([right, down]))
+    b = np.searchsorted(cells, np.concatenate([right + 1, down + cols]))
+
+    labels = np.arange(cells.size)
+    while True:
+        new_labels = labels.copy()
+        lower = np.minimum(labels[a], labels[b])
+        np.minimum.at(new_labels, a, lower)
+        np.minimum.at(new_labels, b, lower)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+    sizes = np.bincount(labels)
+    return sizes[sizes > 0]
+
+# Engines that can run without plotting, each returns a function making one step and returning the grid
+def make_stepper(forest, p, f, engine="buffered", seed=None):
+    if engine == "buffered":
+        return ForestBuffers(forest, p, f, seed=seed).step
+    if engine == "sparse":
+        return SparseForest(forest, p, f, seed=seed).step
+    raise ValueError(f"Unknown engine: {engine}")
+
+STATS_HEADER = ["p", "f", "density", "member", "step", "empty", "tree", "fire", "burned", "clusters", "largest_cluster"]
+
+# Runs the model without plotting and writes one CSV row per step while it runs, so memory stays the same for any
+# number of steps
+# If clusters_path is given, the size of every fire cluster is written there as (step, size) rows
+# If record_path is given, every generation is also appended to a trajectory file
+def run_headless(size, p, f, density, steps, out_path, engine="buffered", seed=None, member=0, clusters_path=None,
+                 record_path=None, packed=False):
+    rng = np.random.default_rng(seed)
+    forest = init_forest(size, density, dtype=np.uint8, rng=rng)
+    step = make_stepper(forest, p, f, engine=engine, seed=rng)
+
+    with open(out_path, "w", newline="") as out_file:
+        clusters_file = open(clusters_path, "w", newline="") if clusters_path else None
+        recorder = TrajectoryWriter(record_path, forest.shape, packed=packed) if record_path else None
+        try:
+            writer = csv.writer(out_file)
+            writer.writerow(STATS_HEADER)
+            if clusters_file:
+                clusters_writer = csv.writer(clusters_file)
+                clusters_writer.writerow(["step", "size"])
+
+            for t in range(steps + 1):
+                if t > 0:
+                    forest = step()
+                counts = np.bincount(forest.ravel(), minlength=4)
+                sizes = fire_cluster_sizes(forest)
+                writer.writerow([p, f, density, member, t, *counts.tolist(), sizes.size, sizes.max(initial=0)])
+                if clusters_file:
+                    clusters_writer.writerows((t, n) for n in sizes.tolist())
+                if recorder:
+                    recorder.append(forest)
+        finally:
+            if clusters_file:
+                clusters_file.close()
+            if recorder:
+                recorder.close()
+    return out_path
+
+def _run_member(args):
+    return run_headless(*args)
+
+# Runs members independent runs for every (p, f, density) combination on a process pool
+# Every run writes its own CSV file into out_dir, seeds are spawned from seed so the ensemble is reproducible
+def run_ensemble(size, steps, ps, fs, densities, members, out_dir, engine="buffered", seed=None, workers=None):
+    os.makedirs(out_dir, exist_ok=True)
+    params = list(itertools.product(ps, fs, densities, range(members)))
+    seeds = np.random.SeedSequence(seed).spawn(len(params))
+    tasks = []
+    for (p, f, density, member), member_seed in zip(params, seeds):
+        out_path = os.path.join(out_dir, f"p{p}_f{f}_d{density}_m{member}.csv")
+        tasks.append((size, p, f, density, steps, out_path, engine, member_seed, member))
+
+    with mp.get_context("fork").Pool(workers) as pool:
+        for out_path in pool.imap_unordered(_run_member, tasks):
+            print(f"Finished {out_path}")
+    return [task[5] for task in tasks]
+
 if __name__ == "__main__":
     size = 100
     p = 0.05
     f = 0.001
     density = 0.8
-    render_anim(size, p, f, density, model_name="Infinite Forest Fire Simulation")
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="Infinite forest fire simulation")
+    parser.add_argument("--headless", action="store_true", help="run without plotting and write statistics to CSV")
+    parser.add_argument("--size", type=int, default=size)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--p", type=float, nargs="+", default=[p])
+    parser.add_argument("--f", type=float, nargs="+", default=[f])
+    parser.add_argument("--density", type=float, nargs="+", default=[density])
+    parser.add_argument("--members", type=int, default=1, help="independent runs for every parameter combination")
+    parser.add_argument("--engine", choices=["buffered", "sparse"], default="buffered")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="forest_stats", help="CSV file for one run, directory for an ensemble")
+    parser.add_argument("--clusters", default=None, help="CSV file for the size of every fire cluster of one run")
+    parser.add_argument("--record", default=None, help="trajectory file to append every generation to")
+    parser.add_argument("--packed", action="store_true", help="store recorded frames with two bits per cell")
+    parser.add_argument("--replay", default=None, help="trajectory file to show instead of running the model")
+    parser.add_argument("--start-frame", type=int, default=0, help="first frame shown when replaying")
+    args = parser.parse_args()
+
+    if not args.headless:
+        render_anim(args.size, args.p[0], args.f[0], args.density[0], model_name="Infinite Forest Fire Simulation",
+                    record=args.record, packed=args.packed, replay=args.replay, start_frame=args.start_frame)
+    elif len(args.p) == len(args.f) == len(args.density) == args.members == 1:
+        run_headless(args.size, args.p[0], args.f[0], args.density[0], args.steps, args.out,
+                     engine=args.engine, seed=args.seed, clusters_path=args.clusters,
+                     record_path=args.record, packed=args.packed)
+    else:
+        run_ensemble(args.size, args.steps, args.p, args.f, args.density, args.members, args.out,
+                     engine=args.engine, seed=args.seed, workers=args.workers)
\ No newline at end of file
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from t12ff import init_forest, update_forest, update_forest_vectorized
+
+
+# The vectorized engine draws its random numbers in the same order as the reference loop,
+# so under the same np.random seed both must give the same forest every generation
+@pytest.mark.parametrize("size", [20, 37])
+def test_vectorized_matches_reference(size):
+    np.random.seed(0)
+    forest = init_forest(size, 0.5)
+    # Start a few fires so spreading, burning out and regrowth all happen
+    forest[np.random.rand(size, size) < 0.05] = 2
+
+    for generation in range(30):
+        np.random.seed(generation)
+        expected = update_forest(forest, size, 0.05, 0.01)
+        np.random.seed(generation)
+        actual = update_forest_vectorized(forest, size, 0.05, 0.01)
+        np.testing.assert_array_equal(actual, expected)
+        forest = expected
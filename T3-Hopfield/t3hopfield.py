@@ -29,7 +29,10 @@ class HopfieldNetwork:
     
     # Updates the network with a given pattern by iterating through the neurons and updating their states based on the weighted sum of their inputs.
     # The process continues until the pattern stabilizes or the maximum number of iterations is reached.
-    def update(self, pattern, max_iterations=10):
+    # With synchronous=True all neurons are updated at once from the full product W @ s in every step.
+    def update(self, pattern, max_iterations=10, synchronous=False):
+        if synchronous:
+            return self.recall_batch(np.array(pattern)[None, :], max_iterations)[0]
         pattern = np.array(pattern)
         prev_pattern = np.zeros_like(pattern)
         for _ in range(max_iterations):
@@ -40,7 +43,22 @@ class HopfieldNetwork:
             if np.array_equal(pattern, prev_pattern):
                 break
         return pattern
-    
+
+    # Recalls a (batch, size) matrix of patterns together with synchronous updates.
+    # Every step is one matrix-matrix product of the rows that are still changing with the weights.
+    # A row is frozen once an update leaves it unchanged, so converged patterns cost nothing in later steps.
+    def recall_batch(self, patterns, max_iterations=10):
+        states = np.array(patterns, dtype=self.weights.dtype)
+        active = np.arange(len(states))
+        for _ in range(max_iterations):
+            if active.size == 0:
+                break
+            new_states = np.where(states[active] @ self.weights.T > 0, 1.0, -1.0)
+            converged = np.all(new_states == states[active], axis=1)
+            states[active] = new_states
+            active = active[~converged]
+        return states.astype(int)
+
 # GridApp class to create the GUI for the Hopfield network pattern editor
 class GridApp:
     # Initializes the GridApp with a root window, grid size, and cell size. It sets up the canvas, buttons, and status bar.
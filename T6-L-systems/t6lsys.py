@@ -1,12 +1,56 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
+import argparse
+import base64
+import io
 import math
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+import numpy as np
+from collections import Counter, OrderedDict
+
+# Least recently used cache for L-system strings and geometry, limited to max_bytes
+# Strings are keyed by (axiom, rules, iterations), geometry by (axiom, rules, iterations, angle)
+# A lock guards the entries because drawing workers of cancelled draws can still be finishing
+class LSystemCache:
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def size(self, data):
+        return data.nbytes if isinstance(data, np.ndarray) else sys.getsizeof(data)
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, data):
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.size(self.entries.pop(key))
+            self.entries[key] = data
+            self.nbytes += self.size(data)
+            while self.nbytes > self.max_bytes and self.entries:
+                _, old = self.entries.popitem(last=False)
+                self.nbytes -= self.size(old)
 
 class LSystemGenerator:
     # Initialization of the L-system generator
+    # root can be None when the generator is only used for headless export
     def __init__(self, root):
         self.root = root
-        self.root.title("L-System Generator")
+        if self.root is not None:
+            self.root.title("L-System Generator")
         
         # Color theme
         self.bg_color = "#00264d"
@@ -17,6 +61,23 @@ class LSystemGenerator:
         self.entry_width = 15
 
         self.font = ("Arial", 10)
+
+        # Longest L-system string that will be built, longer expansions are refused before they are built
+        # and drawing falls back to the lazy walk
+        self.max_length = 5_000_000
+
+        # Number of segments handed to the renderers at once
+        self.chunk_size = 16384
+
+        # Drawing runs in a worker thread, the Tk loop polls its batches every poll_interval milliseconds
+        # and draws for at most poll_budget seconds per poll
+        self.poll_interval = 30
+        self.poll_budget = 0.05
+        self.cancel_event = None
+
+        # Expansions and geometry of earlier draws, so only changing the position, line size or starting angle
+        # does not generate the L-system again
+        self.cache = LSystemCache()
         
         # Default templates
         # Each template has a name, axiom, rule, angle, and angle type
@@ -47,9 +108,23 @@ class LSystemGenerator:
     def create_canvas(self):
         self.canvas = tk.Canvas(self.canvas_frame, bg=self.canvas_bg, width=600, height=500)
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        # Tk only shows a PhotoImage while a reference to it is kept
+        self.photo = None
+        self.raster_item = None
 
     def clear_canvas(self):
+        self.cancel_drawing()
         self.canvas.delete("all")
+        self.photo = None
+        self.raster_item = None
+
+    # Size of the canvas in pixels, the configured size is used before the window is shown
+    def canvas_size(self):
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            width, height = int(self.canvas["width"]), int(self.canvas["height"])
+        return width, height
         
     # Sets the styles of widgets
     def set_style(self):
@@ -125,6 +200,22 @@ class LSystemGenerator:
         line_size_entry = tk.Entry(col2, textvariable=self.line_size, bg=self.input_bg, fg=self.fg_color, width=self.entry_width)
         line_size_entry.pack(fill=tk.X)
 
+    # Dropdown for the way segments are put on the canvas
+    # polylines = one canvas item per connected chain, raster = one image, lines = one canvas item per segment
+    def define_uinput_renderer(self):
+        renderer_frame = tk.Frame(self.control_frame, bg=self.bg_color, pady=5)
+        renderer_frame.pack(fill=tk.X)
+
+        tk.Label(renderer_frame, text="Renderer", bg=self.bg_color, fg=self.fg_color, font=self.font).pack(anchor="w", pady=(0, 5))
+        self.renderer = tk.StringVar(value="polylines")
+        renderer_combo = ttk.Combobox(renderer_frame, textvariable=self.renderer, values=["polylines", "raster", "lines"], width=self.entry_width*2+3, state="readonly")
+        renderer_combo.pack(fill=tk.X)
+
+        self.lod = tk.BooleanVar(value=True)
+        lod_check = tk.Checkbutton(renderer_frame, text="Level of detail", variable=self.lod, bg=self.bg_color, fg=self.fg_color,
+                                   selectcolor=self.input_bg, activebackground=self.bg_color, activeforeground=self.fg_color, font=self.font)
+        lod_check.pack(anchor="w", pady=(5, 0))
+
     # The axiom, rule, and angle type are set to the first template by default
     # The template dropdown allows the user to select a different template
     # Fields are not editable
@@ -191,6 +282,25 @@ class LSystemGenerator:
                               command=self.clear_canvas)
         clear_btn.pack(pady=5)
 
+        svg_btn = tk.Button(button_frame, text="Export SVG", font=self.font, bg=self.button_bg, fg=self.fg_color,
+                            width=button_width, borderwidth=0, relief="flat", activebackground="#005cb3",
+                            command=lambda: self.export_lsystem("svg"))
+        svg_btn.pack(pady=5)
+
+        png_btn = tk.Button(button_frame, text="Export PNG", font=self.font, bg=self.button_bg, fg=self.fg_color,
+                            width=button_width, borderwidth=0, relief="flat", activebackground="#005cb3",
+                            command=lambda: self.export_lsystem("png"))
+        png_btn.pack(pady=5)
+
+        cancel_btn = tk.Button(button_frame, text="Cancel", font=self.font, bg="#800000", fg=self.fg_color,
+                               width=button_width, borderwidth=0, relief="flat", activebackground="#b30000",
+                               command=self.cancel_drawing)
+        cancel_btn.pack(pady=5)
+
+        self.progress = tk.StringVar(value="")
+        progress_label = tk.Label(button_frame, textvariable=self.progress, bg=self.bg_color, fg=self.fg_color, font=self.font)
+        progress_label.pack(pady=5)
+
     # Fucntion for option menu to load the selected template
     def load_template(self, event=None):
         selected = self.template_var.get()
@@ -218,6 +328,486 @@ class LSystemGenerator:
             result = new_result
             
         return result
+
+    # Parses rules written as "F -> FF, X -> F[+X]" into a dictionary, predecessors can have more than one symbol
+    def parse_rules(self, rule_text):
+        rules = {}
+        for rule in rule_text.split(","):
+            rule = rule.strip()
+            if "->" in rule:
+                parts = rule.split("->")
+                if len(parts) == 2 and parts[0].strip():
+                    symbol = parts[0].strip()
+                    replacement = parts[1].strip()
+                    rules[symbol] = replacement
+        return rules
+
+    # Predicts the length of every generation from the number of each symbol, without building the strings
+    # It only works when every predecessor is a single symbol, otherwise None is returned
+    def predict_lengths(self, axiom, rules, iterations):
+        if any(len(symbol) != 1 for symbol in rules):
+            return None
+        produced = {symbol: Counter(replacement) for symbol, replacement in rules.items()}
+        counts = Counter(axiom)
+        lengths = [len(axiom)]
+        for _ in range(iterations):
+            new_counts = Counter()
+            for symbol, count in counts.items():
+                for new_symbol, times in produced.get(symbol, {symbol: 1}).items():
+                    new_counts[new_symbol] += count * times
+            counts = new_counts
+            lengths.append(sum(counts.values()))
+        return lengths
+
+    # Expands the L-system in time linear in the size of the result
+    # Single symbol predecessors are replaced by str.translate, otherwise one regular expression matching the
+    # longest predecessor first replaces every generation in one pass
+    # Raises ValueError when a generation would be longer than max_length
+    def expand_lsystem(self, axiom, rules, iterations):
+        lengths = self.predict_lengths(axiom, rules, iterations)
+        if lengths is not None and lengths[-1] > self.max_length:
+            raise ValueError(f"the L-system would have {lengths[-1]} symbols, the limit is {self.max_length}")
+
+        if lengths is not None:
+            table = str.maketrans(rules)
+            replace = lambda text: text.translate(table)
+        else:
+            pattern = re.compile("|".join(re.escape(symbol) for symbol in sorted(rules, key=len, reverse=True)))
+            replace = lambda text: pattern.sub(lambda match: rules[match.group(0)], text)
+
+        result = axiom
+        for _ in range(iterations):
+            result = replace(result)
+            if len(result) > self.max_length:
+                raise ValueError(f"the L-system has more than {self.max_length} symbols")
+        return result
+
+    # Key of the rules in the cache
+    def rules_key(self, rules):
+        return tuple(sorted(rules.items()))
+
+    # Expands the L-system through the cache
+    # On a miss the expansion continues from the deepest cached level below the requested one
+    def cached_expansion(self, axiom, rules, iterations):
+        key = (axiom, self.rules_key(rules))
+        result = self.cache.get(key + (iterations,))
+        if result is not None:
+            return result
+
+        level, result = 0, axiom
+        for previous in range(iterations - 1, 0, -1):
+            cached = self.cache.get(key + (previous,))
+            if cached is not None:
+                level, result = previous, cached
+                break
+        result = self.expand_lsystem(result, rules, iterations - level)
+        self.cache.put(key + (iterations,), result)
+        return result
+
+    # Counts how many segments (F) the subtree of every symbol draws after each number of rewrites
+    # counts[depth][symbol] is the number of segments drawn by the symbol rewritten depth times
+    def segment_counts(self, axiom, rules, iterations):
+        symbols = set(axiom) | set(rules) | set("".join(rules.values()))
+        counts = [{symbol: int(symbol == 'F') for symbol in symbols}]
+        for _ in range(iterations):
+            previous = counts[-1]
+            counts.append({symbol: sum(previous[child] for child in rules[symbol]) if symbol in rules else previous[symbol]
+                           for symbol in symbols})
+        return counts
+
+    # Combines the moves of a sequence of symbols into one move (dx, dy, turn) relative to the turtle heading
+    # Returns None when the brackets in the sequence are not balanced, such a sequence cannot be jumped over
+    def combine_moves(self, sequence, moves):
+        x, y, heading = 0.0, 0.0, 0.0
+        stack = []
+        for symbol in sequence:
+            if symbol == '[':
+                stack.append((x, y, heading))
+            elif symbol == ']':
+                if not stack:
+                    return None
+                x, y, heading = stack.pop()
+            else:
+                move = moves[symbol]
+                if move is None:
+                    return None
+                dx, dy, turn = move
+                x += dx * math.cos(heading) - dy * math.sin(heading)
+                y += dx * math.sin(heading) + dy * math.cos(heading)
+                heading += turn
+        if stack:
+            return None
+        return (x, y, heading)
+
+    # Precomputes the net move of the subtree of every symbol for a unit line size and the given turning angle
+    # moves[depth][symbol] is (dx, dy, turn) relative to the turtle heading, or None for unbalanced brackets
+    def subtree_moves(self, axiom, rules, iterations, angle):
+        symbols = set(axiom) | set(rules) | set("".join(rules.values()))
+        base = {}
+        for symbol in symbols:
+            if symbol in "[]":
+                base[symbol] = None
+            elif symbol == '+':
+                base[symbol] = (0.0, 0.0, angle)
+            elif symbol == '-':
+                base[symbol] = (0.0, 0.0, -angle)
+            else:
+                base[symbol] = (float(symbol == 'F'), 0.0, 0.0)
+        moves = [base]
+        for _ in range(iterations):
+            previous = moves[-1]
+            moves.append({symbol: self.combine_moves(rules[symbol], previous) if symbol in rules else previous[symbol]
+                          for symbol in symbols})
+        return moves
+
+    # Precomputes a bounding radius of the subtree of every symbol for a unit line size
+    # Every point the subtree draws is at most radii[depth][symbol] away from where the subtree starts,
+    # a circle does not change when the turtle turns so it fits every heading, None for unbalanced brackets
+    def subtree_radii(self, axiom, rules, iterations, moves):
+        symbols = set(axiom) | set(rules) | set("".join(rules.values()))
+        radii = [{symbol: None if symbol in "[]" else float(symbol == 'F') for symbol in symbols}]
+        for depth in range(1, iterations + 1):
+            previous = radii[-1]
+            current = {}
+            for symbol in symbols:
+                if symbol not in rules:
+                    current[symbol] = previous[symbol]
+                elif moves[depth][symbol] is None:
+                    current[symbol] = None
+                else:
+                    x, y, heading = 0.0, 0.0, 0.0
+                    stack = []
+                    radius = 0.0
+                    for child in rules[symbol]:
+                        if child == '[':
+                            stack.append((x, y, heading))
+                        elif child == ']':
+                            x, y, heading = stack.pop()
+                        else:
+                            radius = max(radius, math.hypot(x, y) + previous[child])
+                            dx, dy, turn = moves[depth - 1][child]
+                            x += dx * math.cos(heading) - dy * math.sin(heading)
+                            y += dx * math.sin(heading) + dy * math.cos(heading)
+                            heading += turn
+                    current[symbol] = radius
+            radii.append(current)
+        return radii
+
+    # Walks the production tree like iterate_lsystem and interprets it at the same time, so every subtree
+    # can be judged by where the turtle is before it is expanded
+    # Subtrees whose bounding circle is outside the (width, height) viewport are jumped over, subtrees whose
+    # bounding circle is smaller than a pixel are drawn as one segment from their start to their end
+    # Yields the segments in arrays of at most chunk_size rows, the cost depends on the visible detail only
+    def lod_segments(self, axiom, rules, iterations, x, y, length, start_angle, angle, width, height, pixel=1.0):
+        if any(len(symbol) != 1 for symbol in rules):
+            raise ValueError("level of detail needs single symbol predecessors")
+        counts = self.segment_counts(axiom, rules, iterations)
+        moves = self.subtree_moves(axiom, rules, iterations, angle)
+        radii = self.subtree_radii(axiom, rules, iterations, moves)
+
+        pos_x, pos_y = x, y
+        current_angle = start_angle
+        turtle = []
+        chunk = []
+        stack = [(iter(axiom), iterations)]
+        while stack:
+            symbols, depth = stack[-1]
+            for symbol in symbols:
+                if depth > 0 and symbol in rules:
+                    move = moves[depth][symbol]
+                    if move is None:
+                        stack.append((iter(rules[symbol]), depth - 1))
+                        break
+                    reach = length * radii[depth][symbol]
+                    hidden = pos_x + reach < 0 or pos_x - reach > width or pos_y + reach < 0 or pos_y - reach > height
+                    if not hidden and 2 * reach >= pixel:
+                        stack.append((iter(rules[symbol]), depth - 1))
+                        break
+
+                    # Jump over the subtree, drawing it as one segment when it is visible
+                    dx, dy, turn = move
+                    new_x = pos_x + length * (dx * math.cos(current_angle) - dy * math.sin(current_angle))
+                    new_y = pos_y + length * (dx * math.sin(current_angle) + dy * math.cos(current_angle))
+                    if not hidden and counts[depth][symbol] > 0:
+                        chunk.append((pos_x, pos_y, new_x, new_y))
+                    pos_x, pos_y = new_x, new_y
+                    current_angle += turn
+                elif symbol == 'F':
+                    new_x = pos_x + length * math.cos(current_angle)
+                    new_y = pos_y + length * math.sin(current_angle)
+                    if not (max(pos_x, new_x) < 0 or min(pos_x, new_x) > width or max(pos_y, new_y) < 0 or min(pos_y, new_y) > height):
+                        chunk.append((pos_x, pos_y, new_x, new_y))
+                    pos_x, pos_y = new_x, new_y
+                elif symbol == '+':
+                    current_angle += angle
+                elif symbol == '-':
+                    current_angle -= angle
+                elif symbol == '[':
+                    turtle.append((pos_x, pos_y, current_angle))
+                elif symbol == ']':
+                    if turtle:
+                        pos_x, pos_y, current_angle = turtle.pop()
+
+                if len(chunk) >= self.chunk_size:
+                    yield np.array(chunk)
+                    chunk = []
+            else:
+                stack.pop()
+        if chunk:
+            yield np.array(chunk)
+
+    # Walks the production tree depth first and yields the commands one by one without building the string
+    # Memory is proportional to the number of iterations, only one iterator per level is kept
+    # When skip(symbol, depth) returns True and the subtree has a known move, the whole subtree is replaced
+    # by one jump command ("J", dx, dy, turn) for a unit line size
+    def iterate_lsystem(self, axiom, rules, iterations, moves=None, skip=None):
+        if any(len(symbol) != 1 for symbol in rules):
+            raise ValueError("lazy expansion needs single symbol predecessors")
+
+        stack = [(iter(axiom), iterations)]
+        while stack:
+            symbols, depth = stack[-1]
+            for symbol in symbols:
+                if depth == 0 or symbol not in rules:
+                    yield symbol
+                elif skip is not None and moves is not None and moves[depth][symbol] is not None and skip(symbol, depth):
+                    yield ("J",) + moves[depth][symbol]
+                else:
+                    stack.append((iter(rules[symbol]), depth - 1))
+                    break
+            else:
+                stack.pop()
+    
+    # Computes the turtle geometry of the whole command string with array operations
+    # Returns an (N, 4) array with one row (x0, y0, x1, y1) per F
+    # Headings and positions are cumulative sums over the whole string, every bracket-free run gets its own
+    # base offset, and only the run boundaries are walked in Python with an explicit stack for [ and ]
+    def compute_segments(self, commands, x, y, length, start_angle, angle):
+        codes = np.frombuffer(commands.encode("utf-32-le"), dtype=np.uint32)
+        turns = np.where(codes == ord('+'), angle, 0.0) - np.where(codes == ord('-'), angle, 0.0)
+        turn_sum = np.concatenate(([0.0], np.cumsum(turns)))
+
+        is_bracket = (codes == ord('[')) | (codes == ord(']'))
+        brackets = np.flatnonzero(is_bracket)
+        opens = (codes[brackets] == ord('[')).tolist()
+        # Run k holds the commands between bracket k-1 and bracket k
+        starts = np.concatenate(([0], brackets + 1))
+        ends = np.concatenate((brackets, [len(codes)]))
+        run_id = np.cumsum(is_bracket) - is_bracket
+
+        # Heading offset of every run, heading of a command is turn_sum + offset of its run
+        turn_starts = turn_sum[starts].tolist()
+        turn_ends = turn_sum[ends].tolist()
+        heading_offsets = []
+        heading = start_angle
+        stack = []
+        for k, is_open in enumerate(opens + [None]):
+            offset = heading - turn_starts[k]
+            heading_offsets.append(offset)
+            end_heading = offset + turn_ends[k]
+            if is_open:
+                stack.append(end_heading)
+                heading = end_heading
+            else:
+                heading = stack.pop() if stack else end_heading
+
+        forward = np.flatnonzero(codes == ord('F'))
+        headings = turn_sum[forward] + np.asarray(heading_offsets)[run_id[forward]]
+        dx = length * np.cos(headings)
+        dy = length * np.sin(headings)
+        x_sum = np.concatenate(([0.0], np.cumsum(dx)))
+        y_sum = np.concatenate(([0.0], np.cumsum(dy)))
+
+        # Position offset of every run, same walk as for the headings
+        forward_starts = np.searchsorted(forward, starts)
+        forward_ends = np.searchsorted(forward, ends)
+        x_starts, y_starts = x_sum[forward_starts].tolist(), y_sum[forward_starts].tolist()
+        x_ends, y_ends = x_sum[forward_ends].tolist(), y_sum[forward_ends].tolist()
+        x_offsets, y_offsets = [], []
+        pos_x, pos_y = x, y
+        stack = []
+        for k, is_open in enumerate(opens + [None]):
+            x_offsets.append(pos_x - x_starts[k])
+            y_offsets.append(pos_y - y_starts[k])
+            end_x, end_y = x_offsets[k] + x_ends[k], y_offsets[k] + y_ends[k]
+            if is_open:
+                stack.append((end_x, end_y))
+                pos_x, pos_y = end_x, end_y
+            else:
+                pos_x, pos_y = stack.pop() if stack else (end_x, end_y)
+
+        runs = run_id[forward]
+        segments = np.empty((len(forward), 4))
+        segments[:, 0] = x_sum[:-1] + np.asarray(x_offsets)[runs]
+        segments[:, 1] = y_sum[:-1] + np.asarray(y_offsets)[runs]
+        segments[:, 2] = segments[:, 0] + dx
+        segments[:, 3] = segments[:, 1] + dy
+        return segments
+
+    # Interprets commands like interpret_draw_lsystem, including jumps, but yields the segments in arrays of
+    # at most chunk_size rows instead of drawing them, so a lazy walk never holds more than one chunk
+    def iterate_segments(self, commands, x, y, length, start_angle, angle):
+        pos_x, pos_y = x, y
+        current_angle = start_angle
+        stack = []
+        chunk = []
+        for cmd in commands:
+            if cmd == 'F':
+                new_x = pos_x + length * math.cos(current_angle)
+                new_y = pos_y + length * math.sin(current_angle)
+                chunk.append((pos_x, pos_y, new_x, new_y))
+                pos_x, pos_y = new_x, new_y
+                if len(chunk) == self.chunk_size:
+                    yield np.array(chunk)
+                    chunk = []
+            elif cmd == '+':
+                current_angle += angle
+            elif cmd == '-':
+                current_angle -= angle
+            elif cmd == '[':
+                stack.append((pos_x, pos_y, current_angle))
+            elif cmd == ']':
+                if stack:
+                    pos_x, pos_y, current_angle = stack.pop()
+            elif type(cmd) is tuple:
+                _, dx, dy, turn = cmd
+                pos_x += length * (dx * math.cos(current_angle) - dy * math.sin(current_angle))
+                pos_y += length * (dx * math.sin(current_angle) + dy * math.cos(current_angle))
+                current_angle += turn
+        if chunk:
+            yield np.array(chunk)
+
+    # Yields the segments of the L-system in arrays
+    # With a (width, height) viewport and single symbol rules, only the visible detail is generated by lod_segments
+    # When the string fits under max_length it is built and its geometry computed with arrays,
+    # otherwise single symbol rules are walked lazily and subtrees that draw nothing are jumped over
+    def segment_chunks(self, axiom, rules, iterations, x, y, length, start_angle, angle, viewport=None):
+        lengths = self.predict_lengths(axiom, rules, iterations)
+        if viewport is not None and lengths is not None:
+            yield from self.lod_segments(axiom, rules, iterations, x, y, length, start_angle, angle, *viewport)
+        elif lengths is None or lengths[-1] <= self.max_length:
+            segments = self.cached_segments(axiom, rules, iterations, x, y, length, start_angle, angle)
+            for start in range(0, len(segments), self.chunk_size):
+                yield segments[start:start + self.chunk_size]
+        else:
+            counts = self.segment_counts(axiom, rules, iterations)
+            moves = self.subtree_moves(axiom, rules, iterations, angle)
+            commands = self.iterate_lsystem(axiom, rules, iterations, moves, skip=lambda symbol, depth: counts[depth][symbol] == 0)
+            yield from self.iterate_segments(commands, x, y, length, start_angle, angle)
+
+    # Segments of the L-system through the cache
+    # The geometry is cached for a unit line size starting at the origin with heading 0,
+    # the position, line size and starting angle only move, scale and rotate it
+    def cached_segments(self, axiom, rules, iterations, x, y, length, start_angle, angle):
+        key = (axiom, self.rules_key(rules), iterations, angle)
+        unit = self.cache.get(key)
+        if unit is None:
+            unit = self.compute_segments(self.cached_expansion(axiom, rules, iterations), 0.0, 0.0, 1.0, 0.0, angle)
+            self.cache.put(key, unit)
+
+        cos = length * math.cos(start_angle)
+        sin = length * math.sin(start_angle)
+        segments = np.empty_like(unit)
+        segments[:, 0::2] = x + cos * unit[:, 0::2] - sin * unit[:, 1::2]
+        segments[:, 1::2] = y + sin * unit[:, 0::2] + cos * unit[:, 1::2]
+        return segments
+
+    # Draws the segments computed by compute_segments
+    def draw_segments(self, segments):
+        for x0, y0, x1, y1 in segments.tolist():
+            self.canvas.create_line(x0, y0, x1, y1, fill=self.fg_color, width=1)
+
+    # Splits segments into chains where every segment starts where the previous one ended
+    # Yields a flat coordinate array (x0, y0, x1, y1, x2, y2, ...) for every chain
+    def polyline_chains(self, segments):
+        if len(segments) == 0:
+            return
+        tolerance = 1e-9 * (1 + np.abs(segments).max())
+        gaps = np.abs(segments[1:, :2] - segments[:-1, 2:]).max(axis=1)
+        breaks = np.flatnonzero(gaps > tolerance) + 1
+        for chain in np.split(segments, breaks):
+            coords = np.empty((len(chain) + 1, 2))
+            coords[0] = chain[0, :2]
+            coords[1:] = chain[:, 2:]
+            yield coords.ravel()
+
+    # Draws every chain of segments as one polyline canvas item
+    def draw_polylines(self, segments):
+        for coords in self.polyline_chains(segments):
+            self.canvas.create_line(coords.tolist(), fill=self.fg_color, width=1)
+
+    # Converts a color like "#ffffff" to an RGB tuple
+    def hex_to_rgb(self, color):
+        return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+
+    # Rasterizes segments into an (height, width, 3) image in place
+    # Every segment is sampled once per pixel of its longer axis, the samples outside the image are dropped
+    def rasterize_segments(self, image, segments, color):
+        height, width = image.shape[:2]
+        steps = np.ceil(np.abs(segments[:, 2:] - segments[:, :2]).max(axis=1)).astype(np.int64) + 1
+        index = np.repeat(np.arange(len(segments)), steps)
+        first = np.repeat(np.cumsum(steps) - steps, steps)
+        t = (np.arange(len(index)) - first) / np.repeat(np.maximum(steps - 1, 1), steps)
+        start = segments[index, :2]
+        points = np.rint(start + t[:, None] * (segments[index, 2:] - start)).astype(np.int64)
+        inside = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+        image[points[inside, 1], points[inside, 0]] = color
+
+    # Rasterizes all chunks into a new image with the canvas colors
+    def rasterize_chunks(self, chunks, width, height):
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[:] = self.hex_to_rgb(self.canvas_bg)
+        color = self.hex_to_rgb(self.fg_color)
+        for segments in chunks:
+            self.rasterize_segments(image, segments, color)
+        return image
+
+    # Writes an RGB image as PNG with zlib and struct, the rows are compressed as they are written
+    def write_png(self, file, image):
+        def write_chunk(tag, data):
+            file.write(struct.pack(">I", len(data)) + tag + data)
+            file.write(struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+        height, width = image.shape[:2]
+        file.write(b"\x89PNG\r\n\x1a\n")
+        write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        compressor = zlib.compressobj()
+        rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+        rows[:, 1:] = image.reshape(height, width * 3)
+        for start in range(0, height, 256):
+            data = compressor.compress(rows[start:start + 256].tobytes())
+            if data:
+                write_chunk(b"IDAT", data)
+        write_chunk(b"IDAT", compressor.flush())
+        write_chunk(b"IEND", b"")
+
+    # Shows an image as one PhotoImage covering the canvas, replacing the image shown before
+    def show_raster(self, image):
+        buffer = io.BytesIO()
+        self.write_png(buffer, image)
+        self.photo = tk.PhotoImage(data=base64.b64encode(buffer.getvalue()), format="png")
+        if self.raster_item is None:
+            self.raster_item = self.canvas.create_image(0, 0, image=self.photo, anchor="nw")
+        else:
+            self.canvas.itemconfigure(self.raster_item, image=self.photo)
+
+    # Streams the chunks to an SVG file, one polyline per chain of segments
+    def export_svg(self, path, chunks, width, height):
+        with open(path, "w") as file:
+            file.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">\n')
+            file.write(f'<rect width="100%" height="100%" fill="{self.canvas_bg}"/>\n')
+            file.write(f'<g fill="none" stroke="{self.fg_color}" stroke-width="1">\n')
+            for segments in chunks:
+                for coords in self.polyline_chains(segments):
+                    points = ("%.2f,%.2f " * (len(coords) // 2)) % tuple(coords.tolist())
+                    file.write(f'<polyline points="{points.rstrip()}"/>\n')
+            file.write("</g>\n</svg>\n")
+
+    # Rasterizes the chunks one by one and writes the image to a PNG file
+    def export_png(self, path, chunks, width, height):
+        image = self.rasterize_chunks(chunks, width, height)
+        with open(path, "wb") as file:
+            self.write_png(file, image)
     
     def interpret_draw_lsystem(self, commands, x, y, length, start_angle, angle):
         # Initialize position and angle
@@ -230,6 +820,7 @@ class LSystemGenerator:
         # Main loop for drawing the L-system
         # Iterates through each command in the L-system string
         # F = move forward, + = turn right, - = turn left, [ = checkpoint, ] = go back to checkpoint
+        # Commands can also come from iterate_lsystem, where ("J", dx, dy, turn) jumps over a skipped subtree
         for cmd in commands:
             if cmd == 'F':
                 new_x = pos_x + length * math.cos(current_angle)
@@ -251,48 +842,166 @@ class LSystemGenerator:
                 if stack:
                     pos_x, pos_y, current_angle = stack.pop()
 
-    # This function parses the L-system string and interprets it to draw on the canvas
+            elif type(cmd) is tuple:
+                _, dx, dy, turn = cmd
+                pos_x += length * (dx * math.cos(current_angle) - dy * math.sin(current_angle))
+                pos_y += length * (dx * math.sin(current_angle) + dy * math.cos(current_angle))
+                current_angle += turn
+
+    # Reads and converts the drawing parameters from the UI
+    def read_parameters(self):
+        x_pos = float(self.x_pos.get())
+        y_pos = float(self.y_pos.get())
+        iterations = int(self.iterations.get())
+        line_size = float(self.line_size.get())
+        start_angle = float(self.angle.get())
+
+        if self.angle_type.get() == "degrees":
+            start_angle = math.radians(start_angle)
+        
+        # Parse rule
+        rules = self.parse_rules(self.rule.get())
+        
+        # Get L-system parameters
+        axiom = self.axiom.get()
+        angle = float(self.l_angle.get())
+        
+        if self.l_angle_type.get() == "degrees":
+            angle = math.radians(angle)
+
+        return axiom, rules, iterations, x_pos, y_pos, line_size, start_angle, angle
+
+    # Number of segments the L-system draws, None when it cannot be counted without expanding it
+    def total_segments(self, axiom, rules, iterations):
+        if any(len(symbol) != 1 for symbol in rules):
+            return None
+        counts = self.segment_counts(axiom, rules, iterations)
+        return sum(counts[iterations][symbol] for symbol in axiom)
+
+    # Puts an item into the batch queue, waiting while it is full
+    # Returns False when the drawing was cancelled in the meantime
+    def put_batch(self, batches, item, cancel):
+        while not cancel.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # Runs in the worker thread, generates the segments and puts them into the queue in batches
+    # None marks the end, an exception is passed on to the Tk loop
+    def generate_batches(self, parameters, batches, cancel):
+        try:
+            for segments in self.segment_chunks(*parameters):
+                if not self.put_batch(batches, segments, cancel):
+                    return
+            self.put_batch(batches, None, cancel)
+        except Exception as e:
+            self.put_batch(batches, e, cancel)
+
+    # Stops the drawing in progress, the segments drawn so far stay on the canvas
+    def cancel_drawing(self):
+        if self.cancel_event is not None and not self.cancel_event.is_set():
+            self.cancel_event.set()
+            self.progress.set(f"Cancelled after {self.drawn} segments")
+
+    # Runs in the Tk loop, draws the batches that are ready and schedules itself again until the worker is done
+    def poll_batches(self, batches, cancel, renderer, total):
+        if cancel.is_set():
+            return
+
+        start = time.perf_counter()
+        done = False
+        while time.perf_counter() - start < self.poll_budget:
+            try:
+                item = batches.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                done = True
+                break
+            if isinstance(item, Exception):
+                cancel.set()
+                self.progress.set("")
+                if isinstance(item, ValueError):
+                    messagebox.showerror("Error", f"Invalid input: {str(item)}")
+                else:
+                    messagebox.showerror("Error", f"An error occurred: {str(item)}")
+                return
+
+            if renderer == "raster":
+                self.rasterize_segments(self.raster_image, item, self.hex_to_rgb(self.fg_color))
+            elif renderer == "polylines":
+                self.draw_polylines(item)
+            else:
+                self.draw_segments(item)
+            self.drawn += len(item)
+
+        if renderer == "raster":
+            self.show_raster(self.raster_image)
+
+        if done:
+            cancel.set()
+            self.progress.set(f"Done, {self.drawn} segments")
+        else:
+            if total is None:
+                self.progress.set(f"Drawn {self.drawn} segments")
+            else:
+                self.progress.set(f"Drawn {self.drawn} of {total} segments ({100 * self.drawn // max(total, 1)}%)")
+            self.root.after(self.poll_interval, self.poll_batches, batches, cancel, renderer, total)
+
+    # This function parses the L-system and starts drawing it on the canvas
     # Its called when the user clicks the Draw button is pressed
+    # The segments are generated in a worker thread and drawn batch by batch, so the window stays responsive
     def draw_lsystem(self):
         # Clear the canvas before drawing
         self.clear_canvas()
     
         try:
             # Get parameters from UI
-            x_pos = float(self.x_pos.get())
-            y_pos = float(self.y_pos.get())
-            iterations = int(self.iterations.get())
-            line_size = float(self.line_size.get())
-            start_angle = float(self.angle.get())
-
-            if self.angle_type.get() == "degrees":
-                start_angle = math.radians(start_angle)
-            
-            # Parse rule
-            rule_text = self.rule.get()
-            rules = {}
-            for rule in rule_text.split(","):
-                rule = rule.strip()
-                if "->" in rule:
-                    parts = rule.split("->")
-                    if len(parts) == 2:
-                        symbol = parts[0].strip()
-                        replacement = parts[1].strip()
-                        rules[symbol] = replacement
-            
-            # Get L-system parameters
-            axiom = self.axiom.get()
-            angle = float(self.l_angle.get())
+            parameters = self.read_parameters()
+            axiom, rules, iterations = parameters[:3]
+            # With level of detail the number of drawn segments is not known in advance
+            if self.lod.get():
+                parameters += (self.canvas_size(),)
+                total = None
+            else:
+                total = self.total_segments(axiom, rules, iterations)
             
-            if self.l_angle_type.get() == "degrees":
-                angle = math.radians(angle)
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid input: {str(e)}")
+            return
+
+        renderer = self.renderer.get()
+        if renderer == "raster":
+            width, height = self.canvas_size()
+            self.raster_image = np.empty((height, width, 3), dtype=np.uint8)
+            self.raster_image[:] = self.hex_to_rgb(self.canvas_bg)
+
+        self.drawn = 0
+        self.progress.set("Generating...")
+        self.cancel_event = threading.Event()
+        batches = queue.Queue(maxsize=8)
+        worker = threading.Thread(target=self.generate_batches, args=(parameters, batches, self.cancel_event), daemon=True)
+        worker.start()
+        self.root.after(self.poll_interval, self.poll_batches, batches, self.cancel_event, renderer, total)
+
+    # Exports the L-system with the current parameters to an SVG or PNG file of the canvas size
+    # Its called when one of the Export buttons is pressed
+    def export_lsystem(self, file_type):
+        path = filedialog.asksaveasfilename(defaultextension="." + file_type, filetypes=[(file_type.upper(), "*." + file_type)])
+        if not path:
+            return
+
+        try:
+            width, height = self.canvas_size()
+            chunks = self.segment_chunks(*self.read_parameters(), viewport=(width, height) if self.lod.get() else None)
+            if file_type == "svg":
+                self.export_svg(path, chunks, width, height)
+            else:
+                self.export_png(path, chunks, width, height)
 
-            # Generate the L-system string
-            result = self.generate_lsystem(axiom, rules, iterations)
-            
-            # Draw the L-system
-            self.interpret_draw_lsystem(result, x_pos, y_pos, line_size, start_angle, angle)
-            
         except ValueError as e:
             messagebox.showerror("Error", f"Invalid input: {str(e)}")
         except Exception as e:
@@ -312,6 +1021,8 @@ class LSystemGenerator:
 
         self.define_uinput_templates()
 
+        self.define_uinput_renderer()
+
         self.define_uinput_control_buttons()
         
     # Main function to run the application
@@ -322,7 +1033,35 @@ class LSystemGenerator:
 
         self.create_controls()
 
-root = tk.Tk()
-app = LSystemGenerator(root)
-app.run()
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="L-system generator")
+    parser.add_argument("--export", default=None, help="SVG or PNG file to write without opening the window")
+    parser.add_argument("--template", type=int, default=1, help="number of the template to export")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--x", type=float, default=150)
+    parser.add_argument("--y", type=float, default=100)
+    parser.add_argument("--line-size", type=float, default=5)
+    parser.add_argument("--start-angle", type=float, default=0, help="starting angle in degrees")
+    parser.add_argument("--width", type=int, default=600)
+    parser.add_argument("--height", type=int, default=500)
+    parser.add_argument("--lod", action="store_true", help="skip detail that is off the image or smaller than a pixel")
+    args = parser.parse_args()
+
+    if args.export:
+        app = LSystemGenerator(None)
+        template = app.templates[args.template - 1]
+        angle = template["angle"]
+        if template["angle_type"] == "degrees":
+            angle = math.radians(angle)
+        chunks = app.segment_chunks(template["axiom"], app.parse_rules(template["rule"]), args.iterations,
+                                    args.x, args.y, args.line_size, math.radians(args.start_angle), angle,
+                                    viewport=(args.width, args.height) if args.lod else None)
+        if args.export.lower().endswith(".svg"):
+            app.export_svg(args.export, chunks, args.width, args.height)
+        else:
+            app.export_png(args.export, chunks, args.width, args.height)
+    else:
+        root = tk.Tk()
+        app = LSystemGenerator(root)
+        app.run()
+        root.mainloop()
\ No newline at end of file
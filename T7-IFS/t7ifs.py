@@ -1,6 +1,11 @@
 # IMPORTANT !!!
 # To go to the next animation, close the window of the current animation.
 # It will start the next one.
+import os
+import queue
+import threading
+import multiprocessing as mp
+from typing import Iterator
 import numpy as np
 
 from matplotlib import pyplot as plt
@@ -29,6 +34,48 @@ def render_anim(
     )
     plt.show()
 
+# Same animation as render_anim, but the frames come from an iterator of (x, y, z) arrays,
+# so only the frame on screen is kept and the animation starts as soon as the first frame is ready
+def render_anim_stream(
+    frames: Iterator[tuple[np.array, np.array, np.array]],
+    model_name: str,
+):
+    fig = plt.figure()
+    ax = plt.axes(projection="3d")
+    ax.set_title(f"{model_name}")
+    x, y, z = next(frames)
+    scat = ax.scatter(x, y, z, c="black")
+
+    def update_frame(frame):
+        scat._offsets3d = frame
+
+    # Frames are pulled inside the GUI event loop, which would only print an exception,
+    # so it is kept, the window is closed and the exception is raised again after plt.show
+    errors = []
+
+    def checked(frames):
+        try:
+            yield from frames
+        except Exception as e:
+            errors.append(e)
+            plt.close(fig)
+
+    animation = FuncAnimation(
+        fig,
+        update_frame,
+        frames=checked(frames),
+        interval=500,
+        repeat=False,
+        cache_frame_data=False,
+    )
+    plt.show()
+    # Generators are closed so their producers stop, plain iterators have nothing to close
+    close = getattr(frames, "close", None)
+    if close is not None:
+        close()
+    if errors:
+        raise errors[0]
+
 # Generates random points within the specified bounds
 def generate_points(bounds, n_points):
 
@@ -39,15 +86,75 @@ def generate_points(bounds, n_points):
     return [x_data], [y_data], [z_data]
 
 # loads a model data from file
+# A row holds the 9 matrix values and 3 translation values, an optional 13th value is the probability of the transformation
 def load_model(filename):
     model = np.loadtxt(filename)
     transformations = []
     for row in model:
         A = row[:9].reshape((3, 3))
-        t = row[9:]
+        t = row[9:12]
         transformations.append((A, t))
     return transformations
 
+# Probability of picking each transformation
+# The 13th column of the model is used when it is there, otherwise the probabilities follow |det(A)|,
+# so maps covering a bigger part of the attractor get more points
+# Maps with a zero determinant (like the stem of the fern) still get 1% of the total weight
+def transformation_probabilities(model):
+    model = np.atleast_2d(model)
+    if model.shape[1] > 12:
+        weights = model[:, 12]
+    else:
+        weights = np.abs(np.linalg.det(model[:, :9].reshape(-1, 3, 3)))
+        weights = np.maximum(weights, 0.01 * weights.sum())
+        if weights.sum() == 0:
+            weights = np.ones(len(model))
+    return weights / weights.sum()
+
+# Loads the model as stacked arrays A (k, 3, 3), t (k, 3) and the transformation probabilities
+# The parsed model is cached next to the text file in a binary .npz file, which is used while it is newer than the text file
+# The cache is only an optimization, if it cannot be written (for example in a read only directory) the model is still returned
+def load_model_arrays(filename, cache=True):
+    cache_filename = os.path.splitext(filename)[0] + ".npz"
+    if cache and os.path.exists(cache_filename) and os.path.getmtime(cache_filename) >= os.path.getmtime(filename):
+        with np.load(cache_filename) as data:
+            return data["A"], data["t"], data["probabilities"]
+
+    model = np.atleast_2d(np.loadtxt(filename))
+    A = model[:, :9].reshape(-1, 3, 3)
+    t = model[:, 9:12]
+    probabilities = transformation_probabilities(model)
+    if cache:
+        try:
+            np.savez(cache_filename, A=A, t=t, probabilities=probabilities)
+        except OSError:
+            pass
+    return A, t, probabilities
+
+# Builds an alias table (Vose's method) for picking transformations with the given probabilities
+# Every column i keeps i with probability accept[i] and gives alias[i] otherwise
+def build_alias_table(probabilities):
+    k = len(probabilities)
+    scaled = np.asarray(probabilities, dtype=float) * k / np.sum(probabilities)
+    accept = np.ones(k)
+    alias = np.arange(k)
+    small = [i for i in range(k) if scaled[i] < 1.0]
+    large = [i for i in range(k) if scaled[i] >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        accept[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    return accept, alias
+
+# Picks one transformation for every uniform number in [0, 1)
+# The integer part of u * k chooses the column and the fractional part decides between the column and its alias
+def sample_alias(accept, alias, uniform):
+    scaled = uniform * len(accept)
+    column = scaled.astype(np.intp)
+    return np.where(scaled - column < accept[column], column, alias[column])
+
 def iteration(current_x, current_y, current_z, transformations, n_points, bounds):
     # Initialize arrays to hold transformed points
     transformed_x = np.zeros(n_points)
@@ -71,10 +178,44 @@ def iteration(current_x, current_y, current_z, transformations, n_points, bounds
 
     return transformed_x, transformed_y, transformed_z
 
-def fern(x_data, y_data, z_data, transformations, n_points, iterations, bounds):
+# Stacks the transformations into a (k, 3, 3) array of matrices and a (k, 3) array of translations
+def stack_transformations(transformations):
+    A = np.stack([A for A, _ in transformations])
+    t = np.stack([t for _, t in transformations])
+    return A, t
+
+# Applies the chosen transformation to every point and clips the results to the bounds
+# points is an (n, 3) array, choices holds the index of the transformation for every point
+# Points are grouped by their transformation, so each group is one matrix multiplication
+def apply_transformations(points, A, t, choices, bounds):
+    transformed = np.empty_like(points)
+    for k in range(len(A)):
+        group = choices == k
+        transformed[group] = points[group] @ A[k].T + t[k]
+    lower = [bounds['x'][0], bounds['y'][0], bounds['z'][0]]
+    upper = [bounds['x'][1], bounds['y'][1], bounds['z'][1]]
+    return np.clip(transformed, lower, upper, out=transformed)
+
+# Batched version of iteration, the transformations for all points are picked at once
+# and every point is transformed and clipped with array operations instead of a loop
+# Transformations are picked uniformly unless probabilities are given
+def iteration_batched(current_x, current_y, current_z, transformations, n_points, bounds, probabilities=None):
+    A, t = stack_transformations(transformations)
+    if probabilities is None:
+        choices = np.random.randint(len(transformations), size=n_points)
+    else:
+        choices = sample_alias(*build_alias_table(probabilities), np.random.random(n_points))
+    points = np.column_stack([current_x, current_y, current_z])
+    transformed = apply_transformations(points, A, t, choices, bounds)
+    return transformed[:, 0], transformed[:, 1], transformed[:, 2]
+
+# iterate is the function making one iteration, iteration_batched by default
+def fern(x_data, y_data, z_data, transformations, n_points, iterations, bounds, iterate=None):
+    if iterate is None:
+        iterate = iteration_batched
     for _ in range(iterations):
         # Apply the transformations to the last set of points
-        transformed_x, transformed_y, transformed_z = iteration(
+        transformed_x, transformed_y, transformed_z = iterate(
             x_data[-1], y_data[-1], z_data[-1], transformations, n_points, bounds
         )
         # appends the transformed points to history
@@ -84,27 +225,236 @@ def fern(x_data, y_data, z_data, transformations, n_points, iterations, bounds):
 
     return x_data, y_data, z_data
 
-def process_model(model_filename, bounds, npoints, iterations):
+# Bins points into the density grid, points outside the bounds never happen because they are clipped
+# The grid has one axis for every bin count, (x, y) for two and (x, y, z) for three
+def bin_points(density, points, bounds):
+    indices = []
+    for axis, name in enumerate("xyz"[:density.ndim]):
+        lower, upper = bounds[name]
+        n_bins = density.shape[axis]
+        index = ((points[:, axis] - lower) * (n_bins / (upper - lower))).astype(np.intp)
+        indices.append(np.minimum(index, n_bins - 1, out=index))
+    # Counts are added straight into the grid, so no temporary the size of the grid is made per chunk
+    if density.flags.c_contiguous:
+        np.add.at(density.reshape(-1), np.ravel_multi_index(indices, density.shape), 1)
+    else:
+        np.add.at(density, tuple(indices), 1)
+
+# Runs the chaos game with chunk_points points at a time and bins every iteration into a density grid,
+# only the grid and one chunk of points stay in memory no matter how many samples are taken
+# The first burn_in iterations are not binned, so the points have time to reach the attractor
+# Passing a grid from an earlier run as density continues the accumulation
+# Transformations are picked uniformly unless probabilities are given
+def accumulate_density(transformations, bounds, samples, bins=(512, 512), chunk_points=1_000_000, burn_in=20,
+                       density=None, rng=None, probabilities=None):
+    if rng is None:
+        rng = np.random.default_rng()
+    if density is None:
+        density = np.zeros(bins, dtype=np.int64)
+    A, t = stack_transformations(transformations)
+    if probabilities is None:
+        probabilities = np.full(len(A), 1 / len(A))
+    accept, alias = build_alias_table(probabilities)
+
+    chunk_points = min(chunk_points, samples)
+    points = np.column_stack([rng.uniform(bounds[name][0], bounds[name][1], chunk_points) for name in "xyz"])
+    for _ in range(burn_in):
+        points = apply_transformations(points, A, t, sample_alias(accept, alias, rng.random(chunk_points)), bounds)
+
+    remaining = samples
+    while remaining > 0:
+        points = apply_transformations(points, A, t, sample_alias(accept, alias, rng.random(chunk_points)), bounds)
+        bin_points(density, points[:remaining], bounds)
+        remaining -= chunk_points
+    return density
+
+def _accumulate_part(args):
+    transformations, bounds, samples, bins, chunk_points, seed, probabilities = args
+    return accumulate_density(transformations, bounds, samples, bins=bins, chunk_points=chunk_points,
+                              rng=np.random.default_rng(seed), probabilities=probabilities)
+
+# Splits the samples between worker processes, every worker accumulates its own density grid
+# with its own random stream spawned from seed and the partial grids are added together
+# The result only depends on seed and the number of workers, the grids are added in worker order
+# An existing pool can be passed to reuse it between models
+# When a grid is passed as density, its shape is used instead of bins
+def accumulate_density_parallel(transformations, bounds, samples, bins=(512, 512), chunk_points=1_000_000,
+                                workers=None, seed=None, probabilities=None, density=None, pool=None):
+    workers = workers or os.cpu_count()
+    if density is not None:
+        bins = density.shape
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    shares = [samples // workers + (i < samples % workers) for i in range(workers)]
+    tasks = [(transformations, bounds, share, bins, chunk_points, child, probabilities)
+             for share, child in zip(shares, seed.spawn(workers)) if share > 0]
+
+    if density is None:
+        density = np.zeros(bins, dtype=np.int64)
+    own_pool = pool is None
+    if own_pool:
+        pool = mp.Pool(workers)
+    try:
+        for part in pool.imap(_accumulate_part, tasks):
+            density += part
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+    return density
+
+# Saves a density grid together with its bounds, so the accumulation can be continued later
+# entropy is the root of the random streams of the grid and runs the number of runs added to it,
+# so a continued accumulation draws new samples instead of repeating the earlier ones
+def save_density(filename, density, bounds, entropy=None, runs=0):
+    extra = {} if entropy is None else {"entropy": np.asarray(entropy, dtype=np.uint32), "runs": runs}
+    np.savez(filename, density=density, bounds=np.array([bounds['x'], bounds['y'], bounds['z']], dtype=float), **extra)
+
+# Returns the grid, its bounds, the entropy of its random streams (None for older files) and the number of runs
+def load_density(filename):
+    with np.load(filename) as data:
+        limits = data["bounds"]
+        bounds = {'x': tuple(limits[0]), 'y': tuple(limits[1]), 'z': tuple(limits[2])}
+        if "entropy" in data:
+            return data["density"], bounds, data["entropy"], int(data["runs"])
+        return data["density"], bounds, None, 0
+
+# Root entropy of the random streams of a new grid, the same seed always gives the same entropy
+def density_entropy(seed):
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.generate_state(4)
+
+# Saves the logarithm of the density as an image, three dimensional grids are summed over z
+def save_density_image(filename, density, cmap="inferno"):
+    if density.ndim == 3:
+        density = density.sum(axis=2)
+    plt.imsave(filename, np.log1p(density).T, cmap=cmap, origin="lower")
+
+# Accumulates samples of a model into a density grid and saves the grid and its image
+# If the grid file already exists, the new samples are added to it, keeping its bins
+# Every run gets its own random streams spawned from the entropy stored with the grid, so continuing
+# never repeats earlier samples, a seed given when continuing must be the seed the grid was started with
+# The samples are split between workers processes, see accumulate_density_parallel
+def process_model_density(model_filename, bounds, samples, bins=(512, 512), chunk_points=1_000_000,
+                          workers=None, seed=None, pool=None):
+    model_name = model_filename.split(".")[0]
+    density_filename = f"{model_name}_density.npz"
+    density = None
+    entropy, runs = None, 0
+    if os.path.exists(density_filename):
+        density, saved_bounds, entropy, runs = load_density(density_filename)
+        if saved_bounds != {name: tuple(map(float, bounds[name])) for name in "xyz"}:
+            raise ValueError(f"{density_filename} was accumulated with different bounds")
+        if seed is not None and (entropy is None or not np.array_equal(entropy, density_entropy(seed))):
+            raise ValueError(f"{density_filename} was accumulated with a different seed, continue it with seed=None")
+    if entropy is None:
+        entropy = density_entropy(seed)
+
+    A, t, probabilities = load_model_arrays(model_filename)
+    run_seed = np.random.SeedSequence(entropy.tolist(), spawn_key=(runs,))
+    density = accumulate_density_parallel(list(zip(A, t)), bounds, samples, bins=bins, chunk_points=chunk_points,
+                                          workers=workers, seed=run_seed, probabilities=probabilities, density=density,
+                                          pool=pool)
+    save_density(density_filename, density, bounds, entropy, runs + 1)
+    save_density_image(f"{model_name}_density.png", density)
+    return density
+
+# Renders a whole library of models with one process pool, each model gets its own seed spawned from seed
+def process_models_density(model_filenames, bounds, samples, bins=(512, 512), chunk_points=1_000_000,
+                           workers=None, seed=None):
+    workers = workers or os.cpu_count()
+    seeds = np.random.SeedSequence(seed).spawn(len(model_filenames))
+    with mp.Pool(workers) as pool:
+        return [process_model_density(model_filename, bounds, samples, bins=bins, chunk_points=chunk_points,
+                                      workers=workers, seed=model_seed, pool=pool)
+                for model_filename, model_seed in zip(model_filenames, seeds)]
+
+# Generator version of fern, it yields the starting points and then the points of every iteration
+# Only the last iteration is kept, iterations=None keeps going until the generator is closed
+def fern_stream(x, y, z, transformations, n_points, bounds, iterations=None, iterate=None):
+    if iterate is None:
+        iterate = iteration_batched
+    yield x, y, z
+    done = 0
+    while iterations is None or done < iterations:
+        x, y, z = iterate(x, y, z, transformations, n_points, bounds)
+        yield x, y, z
+        done += 1
+
+# Runs a generator in a background thread and keeps up to depth of its items ready in a bounded queue,
+# which works as a ring buffer: the thread computes the next items while the current one is used
+# and waits when the buffer is full, so memory stays at depth items
+def prefetch(generator, depth=2):
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # An exception of the generator is kept for the consumer, which raises it again after the last item
+    def produce():
+        try:
+            for item in generator:
+                if not put(item):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            close = getattr(generator, "close", None)
+            if close is not None:
+                close()
+        put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while (item := buffer.get()) is not done:
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+
+# stream=True animates the iterations while they are computed, with depth iterations computed ahead,
+# iterations=None then runs until the window is closed
+def process_model(model_filename, bounds, npoints, iterations, stream=False, depth=2):
     x_data, y_data, z_data = generate_points(bounds, npoints)
-    transformations = load_model(model_filename)
-    x_data, y_data, z_data = fern(x_data, y_data, z_data, transformations, npoints, iterations=iterations, bounds=bounds)
+    A, t, probabilities = load_model_arrays(model_filename)
+    iterate = lambda *args: iteration_batched(*args, probabilities=probabilities)
     model_name = model_filename.split(".")[0]
+    if stream:
+        frames = fern_stream(x_data[0], y_data[0], z_data[0], list(zip(A, t)), npoints, bounds,
+                             iterations=iterations, iterate=iterate)
+        render_anim_stream(prefetch(frames, depth=depth), model_name)
+        return
+    x_data, y_data, z_data = fern(x_data, y_data, z_data, list(zip(A, t)), npoints, iterations=iterations,
+                                  bounds=bounds, iterate=iterate)
     render_anim(x_data, y_data, z_data, model_name)
 
-# Number of points to generate
-npoints = 200
+if __name__ == "__main__":
+    # Number of points to generate
+    npoints = 200
+
+    # Number of iterations to perform
+    iterations = 10
 
-# Number of iterations to perform
-iterations = 10
+    # Bounds of plot and points
+    bounds = {
+        'x': (-1, 1),
+        'y': (0, 5),
+        'z': (0, 1)
+    }
 
-# Bounds of plot and points
-bounds = {
-    'x': (-1, 1),
-    'y': (0, 5),
-    'z': (0, 1)
-}
+    models = ["model1.txt", "model2.txt"]
 
-models = ["model1.txt", "model2.txt"]
+    for model in models:
+        process_model(model, bounds, npoints, iterations, stream=True)
 
-for model in models:
-    process_model(model, bounds, npoints, iterations)
@@ -1,6 +1,16 @@
 # IMPORTANT !!!
 # Use the left mouse button to zoom in and the right mouse button to zoom out.
-# It might take a few seconds to zoom or zoom out because of calculating the Mandelbrot set.
+# Zooming is much faster with the vectorized renderer, mandelbrot_set is kept as the reference implementation.
+import argparse
+import math
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal, localcontext
+import multiprocessing as mp
+from multiprocessing import resource_tracker, shared_memory
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -9,6 +19,12 @@ x0 = (-2.0, 1.0)
 y0 = (-1.5, 1.5)
 res = (600, 400)
 max_iter = 100
+# Function computing the image, None uses mandelbrot_set_vectorized
+renderer = None
+# ProgressiveRenderer used by on_click, None renders every zoom before returning
+progressive = None
+# DeepZoom used by on_click instead of x0 and y0, None uses float64 coordinates
+deep_zoom = None
 
 def mandelbrot_set(x_range, y_range, resolution, max_iterations):
     width, height = resolution
@@ -34,8 +50,480 @@ def mandelbrot_set(x_range, y_range, resolution, max_iterations):
 
     return data
 
-def plot_mandelbrot(fig, ax, img, x_range, y_range, resolution, max_iterations):
-    data = mandelbrot_set(x_range, y_range, resolution, max_iterations)
+# Points inside the main cardioid or the period 2 bulb, they never escape
+def in_cardioid_or_bulb(cx, cy):
+    x = cx - 0.25
+    y2 = cy * cy
+    q = x * x + y2
+    cardioid = q * (q + x) <= 0.25 * y2
+    bulb = (cx + 1) * (cx + 1) + y2 <= 0.0625
+    return cardioid | bulb
+
+# Escape time of every point c = cx + i*cy, cx and cy are flat arrays of the same float dtype
+# All points are iterated together, escaped points are marked and dropped from the arrays once they are
+# a quarter of them, so the work follows the number of points still iterating
+# The operations are the same as in mandelbrot_set, so float64 gives the same counts
+# cancel is an optional threading.Event, when it is set the computation stops and None is returned
+# Optional shortcuts for points inside the set, both give the same counts as the plain iteration:
+# interior_check gives max_iterations straight away to points in the main cardioid or the period 2 bulb,
+# periodicity saves z at every power of two iteration and stops points whose z comes back to exactly
+# the saved value, such an orbit repeats forever and never escapes
+def escape_time(cx, cy, max_iterations, cancel=None, interior_check=False, periodicity=False):
+    counts = np.full(cx.shape, max_iterations, dtype=int)
+    active = np.arange(cx.size)
+    if interior_check:
+        outside = ~in_cardioid_or_bulb(cx, cy)
+        active, cx, cy = active[outside], cx[outside], cy[outside]
+    zx = np.zeros_like(cx)
+    zy = np.zeros_like(cy)
+    zx2 = np.empty_like(cx)
+    zy2 = np.empty_like(cy)
+    radius = np.empty_like(cx)
+    new = np.empty(cx.shape, dtype=bool)
+    escaped = np.zeros(cx.shape, dtype=bool)
+    n_escaped = 0
+    saved_x = np.full_like(cx, np.nan)
+    saved_y = np.full_like(cy, np.nan)
+
+    # Marked points keep iterating until they are dropped and may overflow, which is harmless
+    with np.errstate(over="ignore", invalid="ignore"):
+        for iteration in range(max_iterations):
+            if active.size == 0:
+                break
+            if cancel is not None and cancel.is_set():
+                return None
+            np.multiply(zx, zx, out=zx2)
+            np.multiply(zy, zy, out=zy2)
+            np.add(zx2, zy2, out=radius)
+            np.greater(radius, 4, out=new)
+            new &= ~escaped
+            n_new = np.count_nonzero(new)
+            if n_new:
+                counts[active[new]] = iteration
+                escaped |= new
+                n_escaped += n_new
+
+            if periodicity:
+                # Periodic points keep max_iterations and are dropped like escaped ones
+                np.equal(zx, saved_x, out=new)
+                new &= zy == saved_y
+                new &= ~escaped
+                n_periodic = np.count_nonzero(new)
+                if n_periodic:
+                    escaped |= new
+                    n_escaped += n_periodic
+                if iteration & (iteration - 1) == 0:
+                    saved_x[...] = zx
+                    saved_y[...] = zy
+
+            if 4 * n_escaped > active.size:
+                keep = ~escaped
+                active = active[keep]
+                cx, cy, zx, zy, zx2, zy2 = cx[keep], cy[keep], zx[keep], zy[keep], zx2[keep], zy2[keep]
+                saved_x, saved_y = saved_x[keep], saved_y[keep]
+                radius = np.empty_like(cx)
+                new = np.empty(cx.shape, dtype=bool)
+                escaped = np.zeros(cx.shape, dtype=bool)
+                n_escaped = 0
+
+            zy *= zx
+            zy *= 2
+            zy += cy
+            np.subtract(zx2, zy2, out=zx)
+            zx += cx
+
+    return counts
+
+# Pixel coordinates of the image, computed the same way as in mandelbrot_set
+# rows and cols are (start, stop) pixel ranges to get only a part of the image
+def pixel_grid(x_range, y_range, resolution, dtype=np.float64, rows=None, cols=None):
+    width, height = resolution
+    rows = rows or (0, height)
+    cols = cols or (0, width)
+    x = x_range[0] + (np.arange(*cols) / width) * (x_range[1] - x_range[0])
+    y = y_range[0] + (np.arange(*rows) / height) * (y_range[1] - y_range[0])
+    cx, cy = np.meshgrid(x.astype(dtype), y.astype(dtype))
+    return cx, cy
+
+# Array based version of mandelbrot_set, it iterates the whole image at once
+# dtype is np.complex128 or np.complex64, complex128 gives the same result as mandelbrot_set
+# interior_check and periodicity turn on the shortcuts of escape_time
+def mandelbrot_set_vectorized(x_range, y_range, resolution, max_iterations, dtype=np.complex128, cancel=None,
+                              interior_check=False, periodicity=False):
+    real_dtype = np.empty(0, dtype=dtype).real.dtype
+    cx, cy = pixel_grid(x_range, y_range, resolution, dtype=real_dtype)
+    counts = escape_time(cx.ravel(), cy.ravel(), max_iterations, cancel=cancel,
+                         interior_check=interior_check, periodicity=periodicity)
+    return None if counts is None else counts.reshape(cx.shape)
+
+# Mariani-Silver rendering: only the border of a rectangle is computed and if the whole border has the same count,
+# the inside is filled with it, otherwise the rectangle is split into four
+# Rectangles are handled a level at a time, so the borders of all rectangles of a level are one escape_time call
+# Rectangles smaller than min_size are computed pixel by pixel
+# The fill relies on the set being connected, so it can miss details thinner than a pixel inside a rectangle
+def mandelbrot_set_mariani_silver(x_range, y_range, resolution, max_iterations, dtype=np.complex128, min_size=8,
+                                  interior_check=False, periodicity=False):
+    width, height = resolution
+    real_dtype = np.empty(0, dtype=dtype).real.dtype
+    cx, cy = pixel_grid(x_range, y_range, resolution, dtype=real_dtype)
+    cx, cy = cx.ravel(), cy.ravel()
+    data = np.full(width * height, -1, dtype=int)
+
+    def compute(pixels):
+        pixels = pixels[data[pixels] < 0]
+        data[pixels] = escape_time(cx[pixels], cy[pixels], max_iterations,
+                                   interior_check=interior_check, periodicity=periodicity)
+
+    def pixels_of(r0, r1, c0, c1):
+        rows, cols = np.mgrid[r0:r1, c0:c1]
+        return (rows * width + cols).ravel()
+
+    def border_of(r0, r1, c0, c1):
+        rows = np.arange(r0, r1)
+        cols = np.arange(c0, c1)
+        return np.unique(np.concatenate([r0 * width + cols, (r1 - 1) * width + cols,
+                                         rows * width + c0, rows * width + c1 - 1]))
+
+    level = [(0, height, 0, width)]
+    while level:
+        small, large = [], []
+        for rect in level:
+            if rect[1] - rect[0] <= min_size or rect[3] - rect[2] <= min_size:
+                small.append(rect)
+            else:
+                large.append(rect)
+        if small:
+            compute(np.concatenate([pixels_of(*rect) for rect in small]))
+        if not large:
+            break
+        borders = [border_of(*rect) for rect in large]
+        compute(np.concatenate(borders))
+
+        level = []
+        for (r0, r1, c0, c1), border in zip(large, borders):
+            values = data[border]
+            if (values == values[0]).all():
+                data[pixels_of(r0 + 1, r1 - 1, c0 + 1, c1 - 1)] = values[0]
+            else:
+                # The children share the computed border lines of the parent
+                rm, cm = (r0 + r1) // 2, (c0 + c1) // 2
+                level += [(r0, rm + 1, c0, cm + 1), (r0, rm + 1, cm, c1), (rm, r1, c0, cm + 1), (rm, r1, cm, c1)]
+
+    return data.reshape(height, width)
+
+# Output image of the current render, attached by name in the tile workers
+# The last attached image is kept, so tiles of the same render do not attach it again
+_tile_output = None
+
+def _attach_tile_output(name, shape):
+    global _tile_output
+    if _tile_output is None or _tile_output[0].name != name:
+        if _tile_output is not None:
+            _tile_output[0].close()
+        shm = shared_memory.SharedMemory(name=name)
+        _tile_output = (shm, np.ndarray(shape, dtype=np.int64, buffer=shm.buf))
+    return _tile_output[1]
+
+# Computes one tile and writes it straight into the shared image, only the tile position is sent back
+def _render_tile(args):
+    name, x_range, y_range, resolution, max_iterations, real_dtype, rows, cols = args
+    output = _attach_tile_output(name, (resolution[1], resolution[0]))
+    cx, cy = pixel_grid(x_range, y_range, resolution, dtype=real_dtype, rows=rows, cols=cols)
+    output[rows[0]:rows[1], cols[0]:cols[1]] = escape_time(cx.ravel(), cy.ravel(), max_iterations).reshape(cx.shape)
+    return rows, cols
+
+# Renders the image in tiles of tile x tile pixels on a process pool
+# Tiles near the set take much longer, so they are handed out one at a time to whichever worker is free
+# Workers write into a shared memory image, so nothing but the tile position is pickled back
+# An instance can be used as the renderer of plot_mandelbrot, the pool is kept between renders
+class TiledRenderer:
+    def __init__(self, workers=None, tile=64, dtype=np.complex128):
+        self.workers = workers or os.cpu_count()
+        self.tile = tile
+        self.real_dtype = np.empty(0, dtype=dtype).real.dtype
+        # Forked workers have to share the resource tracker of this process,
+        # otherwise each starts its own and reports the images as leaked when it exits
+        resource_tracker.ensure_running()
+        self.pool = mp.Pool(self.workers)
+
+    def tiles(self, resolution):
+        width, height = resolution
+        for row in range(0, height, self.tile):
+            for col in range(0, width, self.tile):
+                yield (row, min(row + self.tile, height)), (col, min(col + self.tile, width))
+
+    def __call__(self, x_range, y_range, resolution, max_iterations):
+        width, height = resolution
+        shm = shared_memory.SharedMemory(create=True, size=width * height * np.dtype(np.int64).itemsize)
+        try:
+            output = np.ndarray((height, width), dtype=np.int64, buffer=shm.buf)
+            tasks = [(shm.name, x_range, y_range, resolution, max_iterations, self.real_dtype, rows, cols)
+                     for rows, cols in self.tiles(resolution)]
+            for _ in self.pool.imap_unordered(_render_tile, tasks, chunksize=1):
+                pass
+            data = output.copy()
+            del output
+        finally:
+            shm.close()
+            shm.unlink()
+        return data
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+# Renderer keeping computed tiles between renders, so panning and zooming back to a level seen before
+# only computes the tiles that are not cached yet
+# Zoom levels are powers of two of the starting view (the zoom factors of on_click are 0.5 and 2.0),
+# at level L pixel k sits on the lattice k * dx with dx = base_dx * 2**-L, views are snapped to the nearest pixel
+# The backend computes the coordinates of a run of tiles from the run's own range, so they can differ from a
+# direct render of the view in the last bit, and a point right on a boundary can get a different count
+# Tiles are keyed by (level, tile x, tile y, max_iterations) and the least recently used ones are dropped
+# when they take more than max_bytes
+# Missing tiles are computed in one rectangle by backend, mandelbrot_set_vectorized by default
+class CachedRenderer:
+    def __init__(self, x_range=x0, y_range=y0, resolution=res, tile=64, max_bytes=256 * 2**20, backend=None):
+        self.base = ((x_range[1] - x_range[0]) / resolution[0], (y_range[1] - y_range[0]) / resolution[1])
+        self.tile = tile
+        self.max_bytes = max_bytes
+        self.backend = backend or mandelbrot_set_vectorized
+        self.tiles = OrderedDict()
+        self.nbytes = 0
+
+    # Zoom level of the view, None if it is not a power of two of the starting view
+    def level(self, x_range, y_range, resolution):
+        levels = [np.log2(self.base[0] * resolution[0] / (x_range[1] - x_range[0])),
+                  np.log2(self.base[1] * resolution[1] / (y_range[1] - y_range[0]))]
+        level = round(levels[0])
+        if any(abs(l - level) > 1e-9 for l in levels):
+            return None
+        return level
+
+    def put(self, key, data):
+        self.tiles[key] = data
+        self.nbytes += data.nbytes
+        while self.nbytes > self.max_bytes and self.tiles:
+            _, old = self.tiles.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def __call__(self, x_range, y_range, resolution, max_iterations):
+        level = self.level(x_range, y_range, resolution)
+        if level is None:
+            return self.backend(x_range, y_range, resolution, max_iterations)
+
+        width, height = resolution
+        t = self.tile
+        dx = self.base[0] * 2.0 ** -level
+        dy = self.base[1] * 2.0 ** -level
+        kx, ky = round(x_range[0] / dx), round(y_range[0] / dy)
+        keys = [(level, tx, ty, max_iterations)
+                for ty in range(ky // t, (ky + height - 1) // t + 1)
+                for tx in range(kx // t, (kx + width - 1) // t + 1)]
+
+        found = {}
+        for key in keys:
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+                found[key] = self.tiles[key]
+
+        # Missing tiles are rendered one horizontal run per tile row, so a diagonal pan only renders
+        # the new L-shaped border instead of a rectangle around it
+        missing = [key for key in keys if key not in found]
+        runs = []
+        for key in missing:
+            if runs and runs[-1][-1][2] == key[2] and runs[-1][-1][1] + 1 == key[1]:
+                runs[-1].append(key)
+            else:
+                runs.append([key])
+        for run in runs:
+            tx0, tx1, ty = run[0][1], run[-1][1] + 1, run[0][2]
+            block = self.backend((tx0 * t * dx, tx1 * t * dx), (ty * t * dy, (ty + 1) * t * dy),
+                                 ((tx1 - tx0) * t, t), max_iterations)
+            for key in run:
+                col = (key[1] - tx0) * t
+                found[key] = block[:, col:col + t].copy()
+                self.put(key, found[key])
+
+        data = np.empty((height, width), dtype=int)
+        for key in keys:
+            # Part of the tile inside the view, in view pixels
+            col0, row0 = key[1] * t - kx, key[2] * t - ky
+            c0, r0 = max(col0, 0), max(row0, 0)
+            c1, r1 = min(col0 + t, width), min(row0 + t, height)
+            data[r0:r1, c0:c1] = found[key][r0 - row0:r1 - row0, c0 - col0:c1 - col0]
+        return data
+
+# Orbit of the reference point c = center_x + i*center_y computed in fixed point arithmetic with bits
+# fraction bits (Python integers), center_x and center_y are Decimals
+# Returns the orbit rounded to float64 up to the iteration where it escapes (or max_iterations)
+def reference_orbit(center_x, center_y, max_iterations, bits):
+    with localcontext() as ctx:
+        ctx.prec = int(bits * 0.302) + 20
+        cx = int((center_x * (1 << bits)).to_integral_value())
+        cy = int((center_y * (1 << bits)).to_integral_value())
+    four = 4 << bits
+    scale = 1 << bits
+    zx = zy = 0
+    orbit_x = [0.0]
+    orbit_y = [0.0]
+    for _ in range(max_iterations):
+        zx2 = (zx * zx) >> bits
+        zy2 = (zy * zy) >> bits
+        if zx2 + zy2 > four:
+            break
+        zy = ((zx * zy) >> (bits - 1)) + cy
+        zx = zx2 - zy2 + cx
+        orbit_x.append(zx / scale)
+        orbit_y.append(zy / scale)
+    return np.array(orbit_x), np.array(orbit_y)
+
+# Escape time of points c = reference + dc computed as float64 perturbations dz of the reference orbit:
+# dz(n+1) = 2 * Z(n) * dz(n) + dz(n)^2 + dc
+# Returns the counts and a mask of glitched points, whose |Z + dz| got much smaller than |Z|
+# (glitch_tolerance is the squared ratio) or which outlived the reference orbit, they need another reference
+def perturbation_escape_time(dcx, dcy, orbit_x, orbit_y, max_iterations, glitch_tolerance=1e-6):
+    counts = np.full(dcx.shape, max_iterations, dtype=int)
+    glitched = np.zeros(dcx.shape, dtype=bool)
+    active = np.arange(dcx.size)
+    dzx = np.zeros_like(dcx)
+    dzy = np.zeros_like(dcy)
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        for iteration in range(max_iterations):
+            if iteration >= len(orbit_x):
+                glitched[active] = True
+                break
+            zx, zy = orbit_x[iteration], orbit_y[iteration]
+            x = zx + dzx
+            y = zy + dzy
+            radius = x * x + y * y
+            escaped = radius > 4
+            glitch = ~escaped & (radius < glitch_tolerance * (zx * zx + zy * zy))
+            done = escaped | glitch
+            if done.any():
+                counts[active[escaped]] = iteration
+                glitched[active[glitch]] = True
+                keep = ~done
+                active, dcx, dcy, dzx, dzy = active[keep], dcx[keep], dcy[keep], dzx[keep], dzy[keep]
+                if active.size == 0:
+                    break
+            dzx, dzy = (2 * (zx * dzx - zy * dzy) + dzx * dzx - dzy * dzy + dcx,
+                        2 * (zx * dzy + zy * dzx) + 2 * dzx * dzy + dcy)
+
+    return counts, glitched
+
+# Deep zoom image around center (a pair of Decimals) with size (width, height) of the view
+# One reference orbit is computed in high precision at the center, every pixel is a float64 perturbation of it,
+# so the pixel size can go far below float64 precision of the coordinates (down to about 1e-300)
+# Glitched pixels get a new reference at one of them, up to max_references times
+def mandelbrot_perturbation(center, size, resolution, max_iterations, glitch_tolerance=1e-6, max_references=10):
+    width, height = resolution
+    center_x, center_y = center
+    # Offsets of the pixels from the center, the same pixel positions as pixel_grid
+    dcx, dcy = pixel_grid((-size[0] / 2, size[0] / 2), (-size[1] / 2, size[1] / 2), resolution)
+    dcx, dcy = dcx.ravel(), dcy.ravel()
+    bits = max(64, int(-math.log2(min(size[0] / width, size[1] / height))) + 64)
+
+    data = np.full(width * height, max_iterations, dtype=int)
+    pending = np.arange(width * height)
+    ref_x, ref_y = 0.0, 0.0
+    for _ in range(max_references + 1):
+        orbit_x, orbit_y = reference_orbit(center_x + Decimal(ref_x), center_y + Decimal(ref_y), max_iterations, bits)
+        counts, glitched = perturbation_escape_time(dcx[pending] - ref_x, dcy[pending] - ref_y, orbit_x, orbit_y,
+                                                    max_iterations, glitch_tolerance)
+        data[pending] = counts
+        pending = pending[glitched]
+        if pending.size == 0:
+            break
+        # The next reference is the glitched pixel in the middle of the list
+        ref = pending[pending.size // 2]
+        ref_x, ref_y = dcx[ref], dcy[ref]
+
+    return data.reshape(height, width)
+
+# View for deep zooms, the center is kept as Decimals and the size of the view as floats
+# The image shows offsets from the center, so clicked positions stay accurate at any depth
+class DeepZoom:
+    def __init__(self, x_range=x0, y_range=y0):
+        self.center = (Decimal(repr(x_range[0])) + Decimal(repr(x_range[1]))) / 2, \
+                      (Decimal(repr(y_range[0])) + Decimal(repr(y_range[1]))) / 2
+        self.size = (x_range[1] - x_range[0], y_range[1] - y_range[0])
+
+    # Moves the center to the clicked offset and scales the view by zoom_factor
+    def zoom(self, x_offset, y_offset, zoom_factor):
+        with localcontext() as ctx:
+            ctx.prec = max(28, int(-math.log10(min(self.size))) + 20)
+            self.center = (self.center[0] + Decimal(x_offset), self.center[1] + Decimal(y_offset))
+        self.size = (self.size[0] * zoom_factor, self.size[1] * zoom_factor)
+
+    def render(self, resolution, max_iterations):
+        return mandelbrot_perturbation(self.center, self.size, resolution, max_iterations)
+
+    def extent(self):
+        return [-self.size[0] / 2, self.size[0] / 2, -self.size[1] / 2, self.size[1] / 2]
+
+    def title(self):
+        digits = max(3, int(-math.log10(min(self.size))) + 3)
+        return f"Center: {self.center[0]:.{digits}f} {self.center[1]:+.{digits}f}i, width {self.size[0]:.3e}"
+
+# Standard viewports for benchmark_interior: the whole set, seahorse valley, elephant valley and a mini set
+VIEWPORTS = {
+    "full": ((-2.0, 1.0), (-1.5, 1.5)),
+    "seahorse": ((-0.76, -0.73), (0.09, 0.12)),
+    "elephant": ((0.25, 0.35), (-0.05, 0.05)),
+    "minibrot": ((-1.7715, -1.7675), (-0.002, 0.002)),
+}
+
+# Compares the interior shortcuts with the plain vectorized engine on the standard viewports
+# Prints the time of every mode and the number of pixels that differ from the plain engine
+def benchmark_interior(resolution=(600, 400), max_iterations=1000, viewports=VIEWPORTS):
+    modes = {
+        "cardioid/bulb": lambda *args: mandelbrot_set_vectorized(*args, interior_check=True),
+        "periodicity": lambda *args: mandelbrot_set_vectorized(*args, periodicity=True),
+        "both": lambda *args: mandelbrot_set_vectorized(*args, interior_check=True, periodicity=True),
+        "mariani-silver": mandelbrot_set_mariani_silver,
+        "mariani-silver+both": lambda *args: mandelbrot_set_mariani_silver(*args, interior_check=True,
+                                                                           periodicity=True),
+    }
+    results = []
+    for name, (x_range, y_range) in viewports.items():
+        start = time.perf_counter()
+        plain = mandelbrot_set_vectorized(x_range, y_range, resolution, max_iterations)
+        plain_time = time.perf_counter() - start
+        print(f"{name}: plain {plain_time:.2f} s")
+        for mode, render in modes.items():
+            start = time.perf_counter()
+            data = render(x_range, y_range, resolution, max_iterations)
+            elapsed = time.perf_counter() - start
+            wrong = int(np.count_nonzero(data != plain))
+            results.append((name, mode, elapsed, wrong))
+            print(f"  {mode}: {elapsed:.2f} s, speedup {plain_time / elapsed:.2f}x, {wrong} pixels differ")
+    return results
+
+# Prints how the tiled renderer scales with the number of workers, compared with mandelbrot_set_vectorized
+def benchmark_tiled(x_range, y_range, resolution, max_iterations, workers_list, tile=64):
+    start = time.perf_counter()
+    mandelbrot_set_vectorized(x_range, y_range, resolution, max_iterations)
+    single = time.perf_counter() - start
+    print(f"vectorized: {single:.2f} s")
+    results = []
+    for workers in workers_list:
+        tiled = TiledRenderer(workers=workers, tile=tile)
+        try:
+            start = time.perf_counter()
+            tiled(x_range, y_range, resolution, max_iterations)
+            elapsed = time.perf_counter() - start
+        finally:
+            tiled.close()
+        results.append((workers, elapsed))
+        print(f"{workers} workers: {elapsed:.2f} s, speedup {single / elapsed:.2f}x")
+    return results
+
+# renderer is the function computing the image, mandelbrot_set_vectorized by default
+def plot_mandelbrot(fig, ax, img, x_range, y_range, resolution, max_iterations, renderer=None):
+    if renderer is None:
+        renderer = mandelbrot_set_vectorized
+    data = renderer(x_range, y_range, resolution, max_iterations)
     
     if img is None:
         img = ax.imshow(data, extent=[x_range[0], x_range[1], y_range[0], y_range[1]], 
@@ -44,11 +532,92 @@ def plot_mandelbrot(fig, ax, img, x_range, y_range, resolution, max_iterations):
         img.set_data(data)
         img.set_extent([x_range[0], x_range[1], y_range[0], y_range[1]])
     
-    ax.set_title(f"Zoom: x=[{x_range[0]:.3f}, {x_range[1]:.3f}], y=[{y_range[0]:.3f}, {y_range[1]:.3f}]")
+    set_title(ax, x_range, y_range)
     fig.canvas.draw_idle()
     
     return img
 
+def set_title(ax, x_range, y_range):
+    ax.set_title(f"Zoom: x=[{x_range[0]:.3f}, {x_range[1]:.3f}], y=[{y_range[0]:.3f}, {y_range[1]:.3f}]")
+
+# Renders views in passes of growing resolution on a background thread and shows every pass in img
+# The first pass has at most preview_width pixels across and at most preview_iterations iterations,
+# so the first frame takes the same time for any resolution and max_iterations
+# Every pass halves the pixel size until the full resolution is reached, the factors are powers of two,
+# so the passes stay on the zoom levels of CachedRenderer
+# A new render cancels the old one, between passes and, with the default renderer, inside a pass as well
+# Results are picked up on the matplotlib thread by a timer, the worker thread never touches the figure
+class ProgressiveRenderer:
+    def __init__(self, fig, img, renderer=None, preview_width=80, preview_iterations=64, poll_interval=30):
+        self.fig = fig
+        self.img = img
+        self.renderer = renderer
+        self.preview_width = preview_width
+        self.preview_iterations = preview_iterations
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.cancel = threading.Event()
+        threading.Thread(target=self.work, daemon=True).start()
+        self.timer = fig.canvas.new_timer(interval=poll_interval)
+        self.timer.add_callback(self.poll)
+        self.timer.start()
+
+    # (resolution, max_iterations) of every pass
+    def passes(self, resolution, max_iterations):
+        width, height = resolution
+        factor = 1
+        while width // factor > self.preview_width:
+            factor *= 2
+        passes = [((max(width // factor, 1), max(height // factor, 1)), min(max_iterations, self.preview_iterations))]
+        while factor > 1:
+            factor //= 2
+            passes.append(((max(width // factor, 1), max(height // factor, 1)), max_iterations))
+        return passes
+
+    def render(self, x_range, y_range, resolution, max_iterations):
+        self.cancel.set()
+        self.cancel = threading.Event()
+        self.generation += 1
+        self.jobs.put((self.generation, self.cancel, x_range, y_range, resolution, max_iterations))
+
+    # An exception of a render is passed to poll as the data of the result, so it is reported
+    # and the thread keeps serving the next renders
+    def work(self):
+        while True:
+            generation, cancel, x_range, y_range, resolution, max_iterations = self.jobs.get()
+            try:
+                for pass_resolution, pass_iterations in self.passes(resolution, max_iterations):
+                    if cancel.is_set():
+                        break
+                    if self.renderer is None:
+                        data = mandelbrot_set_vectorized(x_range, y_range, pass_resolution, pass_iterations, cancel=cancel)
+                    else:
+                        data = self.renderer(x_range, y_range, pass_resolution, pass_iterations)
+                    if data is None or cancel.is_set():
+                        break
+                    self.results.put((generation, x_range, y_range, data))
+            except Exception as e:
+                self.results.put((generation, x_range, y_range, e))
+
+    # Shows the newest finished pass of the current render, failed renders are reported
+    def poll(self):
+        latest = None
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(result[3], Exception):
+                print(f"Render failed: {result[3]!r}")
+            elif result[0] == self.generation:
+                latest = result
+        if latest is not None:
+            _, x_range, y_range, data = latest
+            self.img.set_data(data)
+            self.img.set_extent([x_range[0], x_range[1], y_range[0], y_range[1]])
+            self.fig.canvas.draw_idle()
+
 def on_click(event):
     global x0, y0
     # Check if the event is a mouse click and if the coordinates are valid
@@ -60,6 +629,15 @@ def on_click(event):
     else:
         return
 
+    global img
+    if deep_zoom is not None:
+        deep_zoom.zoom(event.xdata, event.ydata, zoom_factor)
+        img.set_data(deep_zoom.render(res, max_iter))
+        img.set_extent(deep_zoom.extent())
+        ax.set_title(deep_zoom.title(), fontsize=8)
+        fig.canvas.draw_idle()
+        return
+
     x_center = event.xdata
     y_center = event.ydata
 
@@ -70,13 +648,34 @@ def on_click(event):
     x0 = (x_center - x_range / 2, x_center + x_range / 2)
     y0 = (y_center - y_range / 2, y_center + y_range / 2)
 
-    global img
-    img = plot_mandelbrot(fig, ax, img, x0, y0, res, max_iter)
+    if progressive is not None:
+        progressive.render(x0, y0, res, max_iter)
+        set_title(ax, x0, y0)
+        fig.canvas.draw_idle()
+    else:
+        img = plot_mandelbrot(fig, ax, img, x0, y0, res, max_iter, renderer=renderer)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mandelbrot set viewer")
+    parser.add_argument("--deep", action="store_true", help="deep zoom with perturbation past float64 precision")
+    parser.add_argument("--max-iter", type=int, default=max_iter)
+    args = parser.parse_args()
+    max_iter = args.max_iter
+
     fig, ax = plt.subplots(figsize=(8, 8))
-    img = None
-    img = plot_mandelbrot(fig, ax, img, x0, y0, res, max_iter)
+    if args.deep:
+        deep_zoom = DeepZoom()
+        img = ax.imshow(deep_zoom.render(res, max_iter), extent=deep_zoom.extent(), cmap='hot', origin='lower',
+                        vmin=0, vmax=max_iter)
+        ax.set_title(deep_zoom.title(), fontsize=8)
+    else:
+        renderer = CachedRenderer(backend=TiledRenderer())
+        # The image starts empty and is filled by the passes of the progressive renderer
+        img = ax.imshow(np.zeros((1, 1)), extent=[x0[0], x0[1], y0[0], y0[1]], cmap='hot', origin='lower',
+                        vmin=0, vmax=max_iter)
+        progressive = ProgressiveRenderer(fig, img, renderer=renderer)
+        progressive.render(x0, y0, res, max_iter)
+        set_title(ax, x0, y0)
     
     fig.canvas.mpl_connect("button_press_event", on_click)
     plt.show()
\ No newline at end of file